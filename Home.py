@@ -1,4 +1,5 @@
 import streamlit as st
+from technical_indicators import openmetrics
 def main_page():
 
     st.set_page_config(page_title="Home", page_icon="🏠")
@@ -25,4 +26,7 @@ def main_page():
     st.write("...")
 
 if __name__ == "__main__":
-    main_page()
\ No newline at end of file
+    # METRICS_PORT serves the dashboard timings while streamlit runs
+    openmetrics.serve_from_env()
+    with openmetrics.timed('dashboard_render_seconds', page='home'):
+        main_page()
\ No newline at end of file
@@ -0,0 +1,182 @@
+"""
+benchmark of the indicator compute cores on synthetic prices, without any BigQuery I/O.
+
+    python -m benchmarks.indicator_bench                      # 1k to 1M rows, compared with the baseline
+    python -m benchmarks.indicator_bench --sizes 10000000     # a single size
+    python -m benchmarks.indicator_bench --sizes 10000000 --update-baseline   # add the 10M row cases
+
+exits with status 1 when a case of at least gated_rows rows is slower or uses more memory than the
+baseline allows. timings are compared after scaling by a calibration loop timed on both machines,
+the smaller cases are only reported
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from technical_indicators import bitcoin_ema, bollinger_bands, btc_moving_averages, macd, price_archive, rsi
+
+baseline_path = Path(__file__).parent / "baseline.json"
+
+# The 10M row cases are in the baseline too but run only when asked for: they take about a minute
+# and 3 GB of memory, moving_averages alone allocates 2 GB at its peak
+default_sizes = [1_000, 10_000, 100_000, 1_000_000]
+
+# Allowed slowdown and memory growth over the baseline before a case fails
+time_tolerance = float(os.getenv('BENCH_TIME_TOLERANCE', '0.5'))
+memory_tolerance = float(os.getenv('BENCH_MEMORY_TOLERANCE', '0.25'))
+
+# Cases below this many rows take milliseconds, too close to timer and scheduler noise to gate on
+gated_rows = 100_000
+
+# Slowdowns smaller than this are timer noise
+min_slowdown = 0.005
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_prices(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    geometric random walk around bitcoin's price level, one row per minute so any size fits the date range
+    """
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0.0, 0.01, rows)
+
+    return pd.DataFrame({
+        'timestamp': pd.date_range('2000-01-01', periods=rows, freq='min'),
+        'price': 30_000 * np.exp(np.cumsum(returns))
+    })
+
+
+def cases(prices: pd.DataFrame) -> dict:
+    """
+    the compute core of every indicator job, each called on its own copy of the input
+    """
+    emas, _ = bitcoin_ema.compute_ema(prices.copy())
+
+    return {
+        'ema': lambda: bitcoin_ema.compute_ema(prices.copy()),
+        'rsi': lambda: rsi.compute_rsi(prices.copy()),
+        'macd': lambda: macd.compute_macd(emas[['timestamp', 'ema_9', 'ema_12', 'ema_26']].copy()),
+        'bollinger_bands': lambda: bollinger_bands.compute_bollinger_bands(prices.copy()),
+        'moving_averages': lambda: btc_moving_averages.compute_ma(prices.copy())
+    }
+
+
+def calibrate(repeats: int = 5) -> float:
+    """
+    best time of a fixed numpy and pandas workload, the speed of this machine in the baseline's terms
+    """
+    values = synthetic_prices(1_000_000)['price']
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        values.rolling(20).mean()
+        values.ewm(span=26, adjust=False).mean()
+        np.sort(values.to_numpy())
+        seconds.append(time.perf_counter() - start)
+    return round(min(seconds), 6)
+
+
+def measure(function, repeats: int) -> dict:
+    """
+    best wall time of repeats runs and the peak of memory allocated during one run
+    """
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'seconds': round(min(seconds), 6), 'peak_mb': round(peak / 1024 / 1024, 3)}
+
+
+def run(sizes: list[int], repeats: int) -> dict:
+    results = {}
+    for size in sizes:
+        prices = synthetic_prices(size)
+        for name, function in cases(prices).items():
+            result = measure(function, repeats if size < 1_000_000 else 1)
+            results.setdefault(name, {})[str(size)] = result
+            logger.info(f"{name:16} {size:>10,} rows  {result['seconds'] * 1000:10.2f} ms  {result['peak_mb']:10.2f} MB")
+    return results
+
+
+def regressions(results: dict, baseline: dict, speed: float = 1.0) -> list[str]:
+    """
+    gated cases beyond the tolerated slowdown or memory growth over the baseline.
+    speed is this machine's calibration time over the baseline's, expected times are scaled by it
+    """
+    failures = []
+    for name, sizes in results.items():
+        for size, result in sizes.items():
+            expected = baseline.get(name, {}).get(size)
+            if expected is None or int(size) < gated_rows:
+                continue
+            allowed = expected['seconds'] * speed
+            if result['seconds'] - allowed > min_slowdown and result['seconds'] > allowed * (1 + time_tolerance):
+                failures.append(f"{name} at {size} rows: {result['seconds']:.4f}s, "
+                                f"baseline {expected['seconds']:.4f}s scaled to {allowed:.4f}s")
+            if result['peak_mb'] > expected['peak_mb'] * (1 + memory_tolerance):
+                failures.append(f"{name} at {size} rows: {result['peak_mb']:.2f} MB, baseline {expected['peak_mb']:.2f} MB")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="benchmark the indicator compute cores")
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes, help="rows of synthetic prices")
+    parser.add_argument('--repeats', type=int, default=5, help="runs per case below 1M rows, the best one counts")
+    parser.add_argument('--update-baseline', action='store_true', help="store these results as the baseline")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    # EMA warm-up reads the local price archive, an empty one keeps the benchmark free of I/O,
+    # and the compute cores write no spans
+    price_archive.archive_dir = Path(tempfile.mkdtemp())
+    os.environ['ETL_TRACE'] = '0'
+
+    calibration = calibrate()
+    results = run(args.sizes, args.repeats)
+
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+
+    if args.update_baseline:
+        # Timings already stored were taken at the old calibration, they are rescaled to the new one
+        previous = baseline.pop('calibration_seconds', None)
+        if previous:
+            for sizes in baseline.values():
+                for result in sizes.values():
+                    result['seconds'] = round(result['seconds'] * calibration / previous, 6)
+        baseline['calibration_seconds'] = calibration
+        for name, sizes in results.items():
+            baseline.setdefault(name, {}).update(sizes)
+        baseline_path.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        logger.info(f"baseline written to {baseline_path}")
+        return 0
+
+    speed = calibration / baseline.get('calibration_seconds', calibration)
+    logger.info(f"calibration {calibration * 1000:.1f} ms, {speed:.2f}x the baseline machine")
+
+    failures = regressions(results, {name: sizes for name, sizes in baseline.items() if isinstance(sizes, dict)}, speed)
+    for failure in failures:
+        logger.error(f"REGRESSION {failure}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,8 @@
 import pandas as pd
-from google.cloud import bigquery
-from google.oauth2 import service_account
+from technical_indicators import bq_client, profiling, query_backend, tracing
+import argparse
 import logging
+import os
 import warnings
 from datetime import datetime
 warnings.filterwarnings('ignore')
@@ -17,60 +18,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Latest 8 closed days of the wide signals table the pipeline maintains: the report reads the last
+# row and the 7 day volume average. the date filter prunes its partitions so only that window is scanned
+indicators_query = """
+SELECT *
+FROM `connection-123.signals.btc_signals`
+WHERE date_ BETWEEN DATE_SUB(CURRENT_DATE(), INTERVAL 8 DAY) AND DATE_SUB(CURRENT_DATE(), INTERVAL 1 DAY)
+  AND sma_10 IS NOT NULL  -- Ensure we have indicator data
+ORDER BY date_
+"""
+
+
 class BitcoinPredictor:
     def __init__(self, credentials_path: str):
-        self.credentials = service_account.Credentials.from_service_account_file(credentials_path)
-        self.client = bigquery.Client(credentials=self.credentials, project="connection-123")
+        # The duckdb backend reads the local store and needs no credentials
+        self.credentials = None
+        if query_backend.backend_name() != 'duckdb':
+            self.credentials = bq_client.get_credentials(credentials_path)
 
     def fetch_all_indicators(self) -> pd.DataFrame:
         """Fetch and combine all technical indicators from BigQuery"""
-
-        # Main query joining all indicator tables
-        query = """
-        WITH base_data AS (
-            SELECT 
-                p.timestamp as date_,
-                p.price,
-                p.market_cap,
-                p.total_volume,
-                ma.sma_10,
-                ma.sma_20,
-                ma.sma_50,
-                ema.ema_9,
-                ema.ema_12,
-                ema.ema_26,
-                ema.ema_20,
-                ema.ema_50,
-                ema.ema_200,
-                rsi.rsi_14,
-                macd.macd_line,
-                macd.signal_line,
-                macd.histogram,
-                bb.middle_band,
-                bb.upper_band,
-                bb.lower_band,
-                bb.bb_width,
-                bb.percent_b
-            FROM `connection-123.signals.bitcoin_price` p
-            LEFT JOIN `connection-123.signals.btc_moving_averages` ma ON p.timestamp = ma.date_
-            LEFT JOIN `connection-123.signals.btc_ema` ema ON p.timestamp = ema.timestamp
-            LEFT JOIN `connection-123.signals.btc_rsi` rsi ON p.timestamp = rsi.timestamp
-            LEFT JOIN `connection-123.signals.btc_macd` macd ON p.timestamp = macd.timestamp
-            LEFT JOIN `connection-123.signals.btc_bollinger_bands` bb ON p.timestamp = bb.timestamp
-            WHERE p.timestamp BETWEEN DATE_SUB(CURRENT_DATE(), INTERVAL 180 DAY) AND DATE_SUB(CURRENT_DATE(), INTERVAL 1 DAY)
-            ORDER BY p.timestamp
-        )
-        SELECT *
-        FROM base_data
-        WHERE sma_10 IS NOT NULL  -- Ensure we have indicator data
-        """
-
-        query_job = self.client.query(query)
-        df = query_job.result().to_dataframe()
-
-        bytes_processed = query_job.total_bytes_processed
-
-        logger.info(f"Query processed {bytes_processed:,} bytes ({bytes_processed / 1024 / 1024:.2f} MB)")
+        with tracing.span('fetch_all_indicators', job='bitcoin_predictor') as attributes:
+            df, _ = query_backend.run_query(self.credentials, indicators_query)
+            attributes['rows'] = len(df)
 
         logger.info(f"Fetched {len(df)} rows of combined indicator data")
         return df
@@ -292,7 +262,21 @@ def main():
     predictor = BitcoinPredictor(credentials_path)
 
     # Generate comprehensive technical indicator report
-    predictor.generate_indicator_report()
+    if not profiling.wanted('bitcoin_predictor'):
+        predictor.generate_indicator_report()
+        return
+
+    profiling.start_run(tracing.run_id())
+    with profiling.stage('bitcoin_predictor', 'report'):
+        predictor.generate_indicator_report()
+    profiling.finish()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="technical indicator report")
+    parser.add_argument('--profile', action='store_const', const='bitcoin_predictor',
+                        help="profile the report, same as ETL_PROFILE=bitcoin_predictor")
+    args = parser.parse_args()
+    if args.profile:
+        os.environ['ETL_PROFILE'] = args.profile
+
     main()
@@ -1,8 +1,14 @@
+import argparse
 import logging
-from google.oauth2 import service_account
 from typing import Any
 import time
 import os
+import sqlite3
+import threading
+from contextlib import nullcontext
+from datetime import datetime
+
+import scheduler
 
 logging.basicConfig(
     filename='logfile.txt',  
@@ -14,6 +20,7 @@ logger.setLevel(logging.INFO)
 
 dataset = "signals."
 
+from technical_indicators import bq_client, frame_types, job_ledger, metrics_store, openmetrics, profiling, query_backend, table_snapshot, tracing
 from technical_indicators import ( 
     bitcoin_transactions_volume,
     bitcoin_closing_prices,
@@ -30,7 +37,8 @@ from technical_indicators import (
     total_three_divided_btc,
     fear_greed,
     sp_500,
-    bitcoin_fifty_week
+    bitcoin_fifty_week,
+    btc_signals
     )
 
 
@@ -66,11 +74,22 @@ def is_running_locally():
         return 'prod'
 
 def main() -> None:
-    
-    credentials = service_account.Credentials.from_service_account_file("connection-123-892e002c2def.json")
 
     mode = is_running_locally()
 
+    # Local runs and dashboard testing reuse the cached source responses
+    # and read the pipeline tables back from the local store instead of BigQuery, repeated
+    # queries over unchanged tables are answered from the query cache
+    if mode == 'local':
+        os.environ.setdefault('HTTP_CACHE', '1')
+        os.environ.setdefault('QUERY_BACKEND', 'duckdb')
+        os.environ.setdefault('QUERY_CACHE', '1')
+
+    # The duckdb backend reads the local store, a local run needs neither the key file nor the network for it
+    credentials = None
+    if query_backend.backend_name() != 'duckdb':
+        credentials = bq_client.get_credentials("connection-123-892e002c2def.json")
+
     jobs = [
         bitcoin_transactions_volume,
         bitcoin_closing_prices,
@@ -87,30 +106,71 @@ def main() -> None:
         total_three_divided_btc,
         fear_greed,
         sp_500,
-        bitcoin_fifty_week
+        bitcoin_fifty_week,
+        btc_signals
     ]
 
-    total_bytes_processed = 0
-    total_execution_time = 0
+    limits = scheduler.stage_limits()
+
+    # Without credentials the jobs that only read BigQuery cannot run
+    skip = {scheduler.job_key(job): "reads BigQuery only, the query backend is duckdb" for job in jobs
+            if getattr(job, 'bigquery_only', False) and credentials is None}
+
+    # Profiled runs execute one stage at a time so each profile only sees its own job
+    profile = profiling.enabled()
+    if profile:
+        logger.info(f"Profiling {sorted(profiling.selected_jobs())}, stages run one at a time")
 
-    for job in jobs:
+    totals = {'bytes_processed': 0, 'execution_time': 0.0}
+    job_times = {}
+    totals_lock = threading.Lock()
+
+    # Resource and cost record per job, written to the ledger after the run
+    records = {scheduler.job_key(job): job_ledger.new_record(scheduler.job_key(job)) for job in jobs}
+
+    def run_stage(job, stage: str, payload):
+        job_name = job.__name__.title()
         try:
-            job_name = job.__name__.title()
-            logger.info(f"Starting ETL job: {job_name}")
+            if stage == 'extract':
+                logger.info(f"Starting ETL job: {job_name}")
 
             start_time = time.time()
 
-            bytes_processed = job.run_etl(credentials, dataset, mode)
+            profiled = profiling.stage(scheduler.job_key(job), stage) if profile else nullcontext()
+
+            with profiled, job_ledger.active(records[scheduler.job_key(job)], stage), \
+                    tracing.span(stage, job=scheduler.job_key(job)):
+                if stage == 'extract':
+                    result = job.extract(credentials, dataset, mode)
+                elif stage == 'transform':
+                    result = job.transform(payload)
+                else:
+                    result = job.load(credentials, dataset, mode, payload)
+
+            elapsed = time.time() - start_time
+            openmetrics.observe('etl_stage_duration_seconds', elapsed, job=scheduler.job_key(job), stage=stage)
+            with totals_lock:
+                job_times[job_name] = job_times.get(job_name, 0.0) + elapsed
+            logger.debug(f"{job_name}: {stage} finished")
+
+            if stage != 'load':
+                # Compact dtypes from the job's schema before compute and before upload.
+                # float32 only on the frame loaded next, and only for tables derived from other jobs
+                before_load = stage == scheduler.job_stages(job)[-2]
+                float32 = before_load and bool(job.depends_on) and frame_types.float32_enabled()
+                with tracing.span('cast', job=scheduler.job_key(job), float32=float32):
+                    return True, frame_types.cast_payload(result, job.schema(), float32)
 
             # Validate the result
-            if validate_job_result(job_name, bytes_processed):
-                total_bytes_processed += bytes_processed
+            if validate_job_result(job_name, result):
+                execution_time = job_times[job_name]
 
-                end_time = time.time()
-                execution_time = end_time - start_time
-                total_execution_time += execution_time
+                with totals_lock:
+                    totals['bytes_processed'] += result
+                    totals['execution_time'] += execution_time
 
                 logger.info(f"Completed {job_name} in {execution_time:.2f} seconds")
+                return True, result
 
             else:
                 logger.error(f"Failed validation for {job_name}")
@@ -122,9 +182,70 @@ def main() -> None:
         except Exception as e:
             logger.critical(f"Unexpected error: {e}", exc_info=True)
 
+        return False, None
+
+    # Ledger records and spans of this run share its id
+    run_id = job_ledger.run_id()
+    tracing.start_run(run_id)
+    if profile:
+        profiling.start_run(run_id)
+
+    started = datetime.now()
+    run_start = time.time()
+    table_snapshot.clear()
+    try:
+        status = scheduler.run_pipeline(jobs, run_stage, limits, skip)
+    finally:
+        # The snapshot only lives for one run
+        table_snapshot.clear()
+    wall_time = time.time() - run_start
+
+    if profile:
+        profiling.finish()
+
+    failed = [name for name, state in status.items() if state != 'success' and name not in skip]
+    if failed:
+        logger.error(f"Jobs not completed: {failed}")
+
+    for name, state in status.items():
+        records[name]['status'] = state
+        openmetrics.inc('etl_job_runs', job=name, status=state)
+    openmetrics.set_gauge('etl_run_duration_seconds', wall_time)
+    path = job_ledger.write(list(records.values()), run_id)
+    for line in job_ledger.summary(list(records.values())):
+        logger.info(f"Ledger: {line}")
+    logger.info(f"Job records appended to {path}")
+
+    # Run history for the slowdown check, a broken store does not fail the run
+    try:
+        metrics_store.record_run(list(records.values()), run_id, started)
+        for job in metrics_store.check(run_id):
+            logger.warning(f"Slowdown: {job['job']} took {job['seconds']:.2f}s against a median of "
+                           f"{job['median']:.2f}s over its last {job['runs']} runs (robust z {job['z']})")
+    except sqlite3.Error as e:
+        logger.warning(f"Run metrics not stored: {e}")
+
+    # Exposition for the textfile collector of the metrics stack
+    try:
+        logger.info(f"Metrics written to {openmetrics.write_textfile()}")
+    except OSError as e:
+        logger.warning(f"Metrics textfile not written: {e}")
+
+    total_bytes_processed = totals['bytes_processed']
+    total_execution_time = totals['execution_time']
+
     logger.info(f"Total bytes processed across all jobs: {total_bytes_processed / 1024 / 1024:.2f} MB)")
-    logger.info(f"Total execution time: {total_execution_time:.2f} seconds ({total_execution_time / 60:.2f} minutes)")
+    logger.info(f"Total job time: {total_execution_time:.2f} seconds ({total_execution_time / 60:.2f} minutes)")
+    logger.info(f"Total execution time: {wall_time:.2f} seconds ({wall_time / 60:.2f} minutes) with "
+                f"{limits['extract']}/{limits['transform']}/{limits['load']} extract/transform/load workers")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run the ETL jobs")
+    parser.add_argument('--profile', metavar='JOBS', nargs='?', const='all',
+                        help="profile these comma separated jobs (all when no value), same as ETL_PROFILE")
+    args = parser.parse_args()
+    if args.profile:
+        os.environ['ETL_PROFILE'] = args.profile
+
     main()
 
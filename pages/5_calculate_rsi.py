@@ -1,36 +1,15 @@
 import streamlit as st
-import os
-from pathlib import Path
-from os import walk
-import pandas as pd
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+from technical_indicators import local_store, openmetrics
 
-# Build the full path to data.csv
-data_path = Path(__file__).parent.parent
-data_path_str = os.path.join(str(data_path),"technical_indicators","testing_area")
-
-# File to match
-current_file = Path(__file__)
-current_name = current_file.name[2:]
-import_current_name = current_name[:-3]
-
-# Find matching directory and data.csv
-matching_data_file = None
-for dirpath, dirnames, filenames in walk(data_path_str):
-    for dirname in dirnames:
-        if dirname == import_current_name:
-            matching_data_file = os.path.join(dirpath, dirname, "data.csv")
-            break
-    if matching_data_file:
-        break
+# Table the job writes to the local store in local mode
+table_name = "btc_rsi"
 
 @st.cache_data(ttl=60)
-def load_data(matching_data_file):
-    df = pd.read_csv(matching_data_file)
+def load_data(table_name):
+    df = local_store.read(table_name)
     return df
 
-
 def streamlit_page():
     st.title("Bitcoin RSI")
 
@@ -38,7 +17,8 @@ def streamlit_page():
         st.session_state.clear()
         st.rerun()
 
-    df = load_data(matching_data_file)
+    with openmetrics.timed('dashboard_load_seconds', page=table_name):
+        df = load_data(table_name)
 
     if 'period_slider' not in st.session_state:
         st.session_state['period_slider'] = len(df)
@@ -64,4 +44,6 @@ def streamlit_page():
     st.dataframe(df_filtered)
 
 if __name__ == "__main__":
-    streamlit_page()
\ No newline at end of file
+    openmetrics.serve_from_env()
+    with openmetrics.timed('dashboard_render_seconds', page=table_name):
+        streamlit_page()
\ No newline at end of file
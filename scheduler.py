@@ -0,0 +1,165 @@
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from types import ModuleType
+from typing import Any, Callable
+
+from technical_indicators import openmetrics
+
+# Stages of a job, in order
+stages = ('extract', 'transform', 'load')
+
+logger = logging.getLogger(__name__)
+
+
+def job_key(job: ModuleType) -> str:
+    """
+    short name of a job module, the one used in depends_on (e.g. 'bitcoin_ema')
+    """
+    return job.__name__.rsplit('.', 1)[-1]
+
+
+def build_graph(jobs: list[ModuleType]) -> dict[str, list[str]]:
+    """
+    map every job to the jobs it depends on, rejecting unknown names and cycles
+    """
+    keys = [job_key(job) for job in jobs]
+    graph = {}
+
+    for job in jobs:
+        dependencies = list(getattr(job, 'depends_on', []))
+        unknown = [name for name in dependencies if name not in keys]
+        if unknown:
+            raise ValueError(f"{job_key(job)} depends on unknown jobs: {unknown}")
+        graph[job_key(job)] = dependencies
+
+    # Kahn's algorithm, anything left over sits on a cycle
+    remaining = {key: set(dependencies) for key, dependencies in graph.items()}
+    ready = [key for key, dependencies in remaining.items() if not dependencies]
+    while ready:
+        done = ready.pop()
+        del remaining[done]
+        for key, dependencies in remaining.items():
+            if done in dependencies:
+                dependencies.discard(done)
+                if not dependencies:
+                    ready.append(key)
+
+    if remaining:
+        raise ValueError(f"Dependency cycle between jobs: {sorted(remaining)}")
+
+    return graph
+
+
+def stage_limits() -> dict[str, int]:
+    """
+    worker threads per stage and the capacity of the queues between stages, from the environment
+    """
+    defaults = {'extract': 4, 'transform': 2, 'load': 4, 'queue': 4}
+
+    return {name: max(1, int(os.getenv(f'ETL_{name.upper()}_WORKERS' if name != 'queue' else 'ETL_QUEUE_SIZE', default)))
+            for name, default in defaults.items()}
+
+
+def job_stages(job: ModuleType) -> list[str]:
+    """
+    stages a job module implements, transform is optional
+    """
+    missing = [stage for stage in ('extract', 'load') if not hasattr(job, stage)]
+    if missing:
+        raise ValueError(f"{job_key(job)} does not implement {missing}")
+
+    return [stage for stage in stages if hasattr(job, stage)]
+
+
+def run_pipeline(jobs: list[ModuleType], run_stage: Callable[[ModuleType, str, Any], tuple[bool, Any]],
+                 limits: dict[str, int] | None = None, skip: dict[str, str] | None = None) -> dict[str, str]:
+    """
+    run every job as extract -> transform -> load, each stage on its own bounded thread pool,
+    so fetches of the next sources overlap with the loads of earlier ones.
+    a job's extract starts once all of its dependencies were loaded. the queues feeding transform
+    and load hold at most limits['queue'] jobs, extracts wait while they are full.
+    run_stage(job, stage, payload) returns (ok, payload for the next stage); jobs downstream of a
+    failure are skipped. skip maps jobs not to run at all to the reason, they and the jobs downstream
+    of them are skipped too. returns the final status ('success', 'failed' or 'skipped') per job
+    """
+    graph = build_graph(jobs)
+    modules = {job_key(job): job for job in jobs}
+    plans = {key: job_stages(job) for key, job in modules.items()}
+    limits = {**stage_limits(), **(limits or {})}
+
+    status = {}
+    for key, reason in (skip or {}).items():
+        logger.info(f"Skipping {key}: {reason}")
+        status[key] = 'skipped'
+
+    queues = {stage: deque() for stage in stages}
+    running = {}
+    active = {stage: 0 for stage in stages}
+    started = set()
+
+    def downstream_full(stage: str) -> bool:
+        # Jobs handed to the next stages but not picked up yet, plus those being produced now
+        if stage == 'extract':
+            pending = len(queues['transform']) + len(queues['load']) + active['extract'] + active['transform']
+        elif stage == 'transform':
+            pending = len(queues['load']) + active['transform']
+        else:
+            return False
+        return pending >= limits['queue']
+
+    pools = {stage: ThreadPoolExecutor(max_workers=limits[stage], thread_name_prefix=f"etl-{stage}")
+             for stage in stages}
+    try:
+        while len(status) < len(graph):
+
+            # Queue everything whose dependencies are settled, in the declared order
+            for key, dependencies in graph.items():
+                if key in status or key in started:
+                    continue
+                if any(status.get(name) in ('failed', 'skipped') for name in dependencies):
+                    logger.error(f"Skipping {key}: upstream job did not succeed")
+                    status[key] = 'skipped'
+                elif all(status.get(name) == 'success' for name in dependencies):
+                    queues['extract'].append((key, None))
+                    started.add(key)
+
+            # Drain from the end of the pipeline first so finished work leaves the queues
+            for stage in reversed(stages):
+                while queues[stage] and active[stage] < limits[stage] and not downstream_full(stage):
+                    key, payload = queues[stage].popleft()
+                    future = pools[stage].submit(run_stage, modules[key], stage, payload)
+                    running[future] = (key, stage)
+                    active[stage] += 1
+
+            for stage in stages:
+                openmetrics.set_gauge('etl_queue_depth', len(queues[stage]), stage=stage)
+                openmetrics.max_gauge('etl_queue_depth_max', len(queues[stage]), stage=stage)
+                openmetrics.set_gauge('etl_active_stages', active[stage], stage=stage)
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                key, stage = running.pop(future)
+                active[stage] -= 1
+                try:
+                    ok, payload = future.result()
+                except Exception as e:
+                    logger.critical(f"Unexpected error in {key} ({stage}): {e}", exc_info=True)
+                    ok, payload = False, None
+
+                plan = plans[key]
+                if not ok:
+                    status[key] = 'failed'
+                elif stage == plan[-1]:
+                    status[key] = 'success'
+                else:
+                    queues[plan[plan.index(stage) + 1]].append((key, payload))
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True)
+
+    return status
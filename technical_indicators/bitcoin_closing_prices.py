@@ -1,26 +1,27 @@
 import pandas as pd
-import requests
-import pandas_gbq
-import os
 import logging
-from pathlib import Path
+from datetime import date
+from technical_indicators import http_client, local_store, price_archive, query_backend, table_snapshot, tracing, watermark
 
-current_dir = Path(__file__).parent
-local_folder = current_dir / "testing_area"
-local_folder_string = str(local_folder.resolve())
 
 destination_table = "bitcoin_price"
 
+depends_on = []
+
 logger = logging.getLogger(__name__)
 
-def fetch_bitcoin_price() -> pd.DataFrame:
+@tracing.traced('fetch')
+def fetch_bitcoin_price(start: date | None = None) -> pd.DataFrame:
+    """
+    daily closes for the last year, or only from start onwards when the table is already loaded
+    """
     url = 'https://api.coingecko.com/api/v3/coins/bitcoin/market_chart'
     params = {
         'vs_currency': 'usd',
-        'days': '365',
+        'days': str(watermark.days_since(start, default=365)),
         'interval': 'daily'
     }
-    response = requests.get(url, params=params)
+    response = http_client.get(url, params=params)
     response.raise_for_status()
     data = response.json()
     
@@ -49,10 +50,43 @@ def fetch_bitcoin_price() -> pd.DataFrame:
     df = df.groupby('date', as_index=False).last()
     df = df.rename(columns={'date': 'timestamp'})
 
+    if start is not None:
+        df = df[df['timestamp'] >= start].reset_index(drop=True)
+
     logger.info(f"imported {len(df)} rows of data from {url}")
     
     return df
 
+# Closed prices after a checkpoint, filtered on the partition column so older partitions are pruned
+prices_after_query = """
+SELECT
+    timestamp,
+    price
+FROM
+    `connection-123.signals.bitcoin_price`
+WHERE
+    timestamp > @after AND timestamp < CURRENT_DATE()
+ORDER BY
+    timestamp ASC
+"""
+
+def read_prices(credentials, after: date) -> tuple[pd.DataFrame, int]:
+    """
+    closed prices of the table dated after `after`, oldest first
+    """
+    return query_backend.run_query(credentials, prices_after_query, {'after': after})
+
+def prices_after(credentials, after: date) -> tuple[pd.DataFrame, int]:
+    """
+    timestamp and price rows after `after` for incremental indicator runs,
+    taken from the run snapshot when it covers them
+    """
+    rows = table_snapshot.rows_after(destination_table, after, 'timestamp')
+    if rows is not None:
+        return rows[['timestamp', 'price']].copy(), 0
+
+    return read_prices(credentials, after)
+
 def schema() -> list[dict]:
     """
     create the schema for the bq table
@@ -65,35 +99,51 @@ def schema() -> list[dict]:
     ]
     return table_schema
 
-def run_etl(credentials,dataset:str,mode:str) -> int:
+def extract(credentials, dataset: str, mode: str) -> dict:
+    """
+    on incremental prod runs only the range past the watermark is fetched
+    """
+    start = None
+    if mode == 'prod':
+        start = watermark.fetch_start(watermark.load(credentials, dataset, destination_table))
+
+    return {'table': fetch_bitcoin_price(start), 'start': start, 'bytes_processed': 0}
+
+def archive_prices(table: pd.DataFrame) -> None:
+    """
+    keep the full price history in the local archive for the long window indicators.
+    the archive only helps their warm-up, so a failure is logged and the load goes on
+    """
+    try:
+        price_archive.backfill('bitcoin')
+        price_archive.update('bitcoin', table['timestamp'], table['price'])
+    except Exception as e:
+        logger.warning(f"bitcoin price archive not updated: {e}")
+
+def load(credentials, dataset: str, mode: str, payload: dict) -> int:
+    table = payload['table']
+    archive_prices(table)
 
     if mode == 'prod':
 
-        table = fetch_bitcoin_price()
         table_schema = schema()
-        target_table = dataset + destination_table
 
-        pandas_gbq.to_gbq(
-            dataframe=table,
-            destination_table=target_table,
-            project_id="connection-123",
-            table_schema=table_schema,
-            credentials=credentials,
-            if_exists="replace"
-        )
+        watermark.write(credentials, dataset, destination_table, table, table_schema, 'timestamp')
+
+        # A partial fetch only holds the newest rows of the table
+        table_snapshot.publish(destination_table, table, complete=payload['start'] is None)
 
         return 0
 
     else:
         print('test mode')
-        table = fetch_bitcoin_price()
 
-        # Create subdirectory if it doesn't exist
-        subdir = local_folder / fetch_bitcoin_price.__name__
-        subdir.mkdir(parents=True, exist_ok=True)
+        path = local_store.write(destination_table, table, schema(), 'timestamp')
+        print(f'Data saved to {path}')
 
-        csv_filename = os.path.join(str(subdir), "data.csv")
-        table.to_csv(csv_filename, index=False)
-        print(f'Data saved to {csv_filename}')
+        table_snapshot.publish(destination_table, table)
+
+        return 0
 
-        return 0
\ No newline at end of file
+def run_etl(credentials, dataset: str, mode: str) -> int:
+    return load(credentials, dataset, mode, extract(credentials, dataset, mode))
@@ -1,21 +1,26 @@
 import pandas as pd
-import pandas_gbq
-from google.cloud import bigquery
 import logging
-import os
-from pathlib import Path
-
-current_dir = Path(__file__).parent
-local_folder = current_dir / "testing_area"
-local_folder_string = str(local_folder.resolve())
+from datetime import date
+from technical_indicators import bitcoin_closing_prices, bq_client, etl_state, indicator_engine, local_store, price_archive, query_backend, table_snapshot, tracing
 
 
 destination_table = "btc_ema"
 
+depends_on = ["bitcoin_closing_prices"]
+
 logger = logging.getLogger(__name__)
 
-def calculate_ema(credentials,periods=[9,12, 26, 20, 50, 200]) -> tuple[pd.DataFrame,int]:
-    client = bigquery.Client(credentials=credentials, project=credentials.project_id)
+# Periods of archived history used to warm up an EMA, older prices weigh less than e^-10
+warm_up_periods = 5
+
+def fetch_prices(credentials, prices: pd.DataFrame | None = None) -> tuple[pd.DataFrame, int]:
+    """
+    closed bitcoin prices, oldest first. prices is the bitcoin_price table published by this run,
+    when given the query is skipped
+    """
+    if prices is not None:
+        ema = table_snapshot.closed_rows(prices, 'timestamp')[['timestamp', 'price']].copy()
+        return ema, 0
 
     query = """
     SELECT 
@@ -28,21 +33,78 @@ def calculate_ema(credentials,periods=[9,12, 26, 20, 50, 200]) -> tuple[pd.DataF
     ORDER BY 
         timestamp ASC
     """
-    
-    query_job = client.query(query)
-    results = query_job.result()
-    ema = results.to_dataframe()
-    bytes_processed = query_job.total_bytes_processed
-    logger.info(f"Query processed {bytes_processed:,} bytes ({bytes_processed / 1024 / 1024:.2f} MB)")
 
-    # Calculate EMA for each period
-    for period in periods:
-        ema_column = f'ema_{period}'
-        # Calculate EMA using the 'price' column
-        ema[ema_column] = ema['price'].ewm(span=period, adjust=False).mean()
+    return query_backend.run_query(credentials, query)
+
+def calculate_ema(credentials,periods=[9,12, 26, 20, 50, 200], prices: pd.DataFrame | None = None) -> tuple[pd.DataFrame,int]:
+    """
+    prices is the bitcoin_price table published by this run, when given the query is skipped
+    """
+    ema, bytes_processed = fetch_prices(credentials, prices)
+    ema, _ = compute_ema(ema, periods)
     
     return ema, bytes_processed
 
+def warm_up(first: date | None, period: int) -> float | None:
+    """
+    EMA of the archived closes before first, it seeds a series computed from scratch so long
+    periods do not start from the first price. None when the archive has too little history
+    """
+    if first is None:
+        return None
+
+    history = price_archive.before('bitcoin', first, days=warm_up_periods * period)
+    if len(history) < period:
+        return None
+
+    return float(indicator_engine.ema(history, period)[-1])
+
+@tracing.traced('transform')
+def compute_ema(ema: pd.DataFrame, periods=[9,12, 26, 20, 50, 200], previous: dict | None = None) -> tuple[pd.DataFrame, dict | None]:
+    """
+    EMA columns for the price rows in ema, continuing from the persisted values in previous when given.
+    also returns the state at the last final row (None when there is none yet)
+    """
+    # Calculate EMA for each period from the 'price' column
+    prices = indicator_engine.as_price_array(ema['price'])
+    first = pd.Timestamp(ema['timestamp'].iloc[0]).date() if len(ema) else None
+    for period in periods:
+        initial = previous[f'ema_{period}'] if previous else warm_up(first, period)
+        ema[f'ema_{period}'] = indicator_engine.ema(prices, period, initial=initial)
+
+    index = etl_state.checkpoint_index(len(ema))
+    if index is None:
+        return ema, None
+
+    row = ema.iloc[index]
+    state = {'last_date': pd.Timestamp(row['timestamp']).date().isoformat()}
+    for period in periods:
+        state[f'ema_{period}'] = float(row[f'ema_{period}'])
+
+    return ema, state
+
+# EMA rows after a checkpoint, filtered on the partition column so older partitions are pruned
+emas_after_query = """
+SELECT
+    *
+FROM
+    `connection-123.signals.btc_ema`
+WHERE
+    timestamp > @after
+ORDER BY
+    timestamp ASC
+"""
+
+def emas_after(credentials, after: date) -> tuple[pd.DataFrame, int]:
+    """
+    rows of the table dated after `after`, oldest first, from the run snapshot when it covers them
+    """
+    rows = table_snapshot.rows_after(destination_table, after, 'timestamp')
+    if rows is not None:
+        return rows, 0
+
+    return query_backend.run_query(credentials, emas_after_query, {'after': after})
+
 def schema() -> list[dict]:
     """
     create the schema for the bq table
@@ -59,34 +121,55 @@ def schema() -> list[dict]:
     ]
     return table_schema
 
-def run_etl(credentials,dataset:str,mode:str) -> int:
+def extract(credentials, dataset: str, mode: str) -> dict:
+    """
+    price rows after the persisted checkpoint on incremental runs, otherwise all closed prices
+    """
+    if mode == 'prod' and etl_state.incremental_enabled():
+        return etl_state.extract_incremental(credentials, dataset, destination_table, bitcoin_closing_prices.prices_after)
+
+    df, bytes_processed = fetch_prices(credentials, prices=table_snapshot.get("bitcoin_price"))
+    return {'rows': df, 'bytes_processed': bytes_processed}
+
+def transform(payload: dict) -> dict:
+    if payload.get('incremental'):
+        return etl_state.transform_incremental(payload, compute_ema)
+
+    table, _ = compute_ema(payload['rows'])
+    return {'table': table, 'bytes_processed': payload['bytes_processed']}
+
+def load(credentials, dataset: str, mode: str, payload: dict) -> int:
+
+    if payload.get('incremental'):
+        return etl_state.load_incremental(credentials, dataset, destination_table, schema(), payload, publish=True)
+
+    table, bytes_processed = payload['table'], payload['bytes_processed']
 
     if mode == 'prod':
 
-        table,bytes_processed = calculate_ema(credentials)
         table_schema = schema()
         target_table = dataset + destination_table
 
-        pandas_gbq.to_gbq(
+        bq_client.merge_rows(
             dataframe=table,
             destination_table=target_table,
-            project_id="connection-123",
             table_schema=table_schema,
             credentials=credentials,
-            if_exists="replace"
+            key_columns=['timestamp']
         )
 
+        table_snapshot.publish(destination_table, table)
+
         return bytes_processed
 
     else:
         print('test mode')
-        table,bytes_processed = calculate_ema(credentials,periods=[9,12, 26, 20, 50, 200])
-        # Create subdirectory if it doesn't exist
-        subdir = local_folder / calculate_ema.__name__
-        subdir.mkdir(parents=True, exist_ok=True)
+        path = local_store.write(destination_table, table, schema(), 'timestamp')
+        print(f'Data saved to {path}')
 
-        csv_filename = os.path.join(str(subdir), "data.csv")
+        table_snapshot.publish(destination_table, table)
 
-        table.to_csv(csv_filename, index=False)
-        print(f'Data saved to {csv_filename}')
         return bytes_processed
+
+def run_etl(credentials, dataset: str, mode: str) -> int:
+    return load(credentials, dataset, mode, transform(extract(credentials, dataset, mode)))
@@ -1,23 +1,22 @@
-import yfinance as yf
 import pandas as pd
 import functools
 from datetime import datetime
-import pandas_gbq
-from pathlib import Path
-import os
-
-current_dir = Path(__file__).parent
-local_folder = current_dir / "testing_area"
-local_folder_string = str(local_folder.resolve())
+from technical_indicators import bq_client, local_store, price_archive
 
 
 destination_table = "bitcoin_fifty_week"
 
-def get_fifty_weeks() -> pd.DataFrame:
+# The closing prices job brings the price archive up to date
+depends_on = ["bitcoin_closing_prices"]
 
-    btc = yf.download('BTC-USD', period='5y',auto_adjust=False)
+def get_fifty_weeks() -> pd.DataFrame:
+    """
+    50 week SMA of the weekly closes over the full archived history
+    """
+    price_archive.backfill('bitcoin')
+    closes = price_archive.series('bitcoin')
 
-    weekly = btc['Close'].resample('W').last()
+    weekly = closes.resample('W').last()
 
     sma50 = weekly.rolling(window=50).mean()
 
@@ -36,33 +35,32 @@ def schema() -> list[dict]:
     ]
     return table_schema
 
-def run_etl(credentials, dataset: str, mode: str) -> int:
+def extract(credentials, dataset: str, mode: str) -> dict:
+    return {'table': get_fifty_weeks(), 'bytes_processed': 0}
+
+def load(credentials, dataset: str, mode: str, payload: dict) -> int:
+    table = payload['table']
 
     if mode == 'prod':
 
-        table = get_fifty_weeks()
         table_schema = schema()
         target_table = dataset + destination_table
 
-        pandas_gbq.to_gbq(
+        bq_client.merge_rows(
             dataframe=table,
             destination_table=target_table,
-            project_id="connection-123",
             table_schema=table_schema,
             credentials=credentials,
-            if_exists="replace"
+            key_columns=['date']
         )
 
         return 0
 
     else:
         print('test mode')
-        table = get_fifty_weeks()
-        # Create subdirectory if it doesn't exist
-        subdir = local_folder / get_fifty_weeks.__name__
-        subdir.mkdir(parents=True, exist_ok=True)
-
-        csv_filename = os.path.join(str(subdir), "data.csv")
-        table.to_csv(csv_filename, index=False)
-        print(f'Data saved to {csv_filename}')
+        path = local_store.write(destination_table, table, schema(), 'date')
+        print(f'Data saved to {path}')
         return 0
+
+def run_etl(credentials, dataset: str, mode: str) -> int:
+    return load(credentials, dataset, mode, extract(credentials, dataset, mode))
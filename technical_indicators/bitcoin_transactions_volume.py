@@ -1,24 +1,19 @@
 import pandas as pd
-import pandas_gbq
-from google.cloud import bigquery
 import logging
-from pathlib import Path
-import os
+from technical_indicators import bq_client, local_store, query_backend
 
 
-current_dir = Path(__file__).parent
-local_folder = current_dir / "testing_area"
-local_folder_string = str(local_folder.resolve())
+destination_table = "bitcoin_transactions"
 
+depends_on = []
 
-destination_table = "bitcoin_transactions"
+# Reads a BigQuery public dataset, runs on the duckdb backend skip it
+bigquery_only = True
 
 logger = logging.getLogger(__name__)
 
 def fetch_transactions(credentials) -> tuple[pd.DataFrame, int]:
    
-    client = bigquery.Client(credentials=credentials, project=credentials.project_id)
-
     query = """
         SELECT 
           DATE(timestamp) as date_,
@@ -32,13 +27,9 @@ def fetch_transactions(credentials) -> tuple[pd.DataFrame, int]:
         ORDER BY 
           1
     """
-    query_job = client.query(query)
-    results = query_job.result()
-    df_transactions_count = results.to_dataframe()
+    # Public dataset, not in the local store, so this always goes to BigQuery
+    df_transactions_count, bytes_processed = query_backend.run_bigquery(credentials, query)
     df_transactions_count['date_'] = df_transactions_count['date_'].astype(str)
-
-    bytes_processed = query_job.total_bytes_processed
-    logger.info(f"Query processed {bytes_processed:,} bytes ({bytes_processed / 1024 / 1024:.2f} MB)")
     
     return df_transactions_count, bytes_processed
 
@@ -52,34 +43,33 @@ def schema() -> list[dict]:
     ]
     return table_schema
 
-def run_etl(credentials,dataset:str,mode:str) -> int:
+def extract(credentials, dataset: str, mode: str) -> dict:
+    table, bytes_processed = fetch_transactions(credentials)
+    return {'table': table, 'bytes_processed': bytes_processed}
+
+def load(credentials, dataset: str, mode: str, payload: dict) -> int:
+    table, bytes_processed = payload['table'], payload['bytes_processed']
 
     if mode == 'prod':
 
-        table, bytes_processed = fetch_transactions(credentials)
         table_schema = schema()
         target_table = dataset + destination_table
 
-        pandas_gbq.to_gbq(
+        bq_client.merge_rows(
             dataframe=table,
             destination_table=target_table,
-            project_id="connection-123",
             table_schema=table_schema,
             credentials=credentials,
-            if_exists="replace"
+            key_columns=['date_']
         )
 
         return bytes_processed
 
     else:
         print('test mode')
-        table, bytes_processed = fetch_transactions(credentials)
-        # Create subdirectory if it doesn't exist
-        subdir = local_folder / fetch_transactions.__name__
-        subdir.mkdir(parents=True, exist_ok=True)
-
-        csv_filename = os.path.join(str(subdir), "data.csv")
-        table.to_csv(csv_filename, index=False)
-        print(f'Data saved to {csv_filename}')
+        path = local_store.write(destination_table, table, schema(), 'date_')
+        print(f'Data saved to {path}')
         return bytes_processed
 
+def run_etl(credentials, dataset: str, mode: str) -> int:
+    return load(credentials, dataset, mode, extract(credentials, dataset, mode))
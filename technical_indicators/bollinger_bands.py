@@ -1,21 +1,23 @@
+import numpy as np
 import pandas as pd
-import pandas_gbq
-from google.cloud import bigquery
 import logging
-from pathlib import Path
-import os
-
-current_dir = Path(__file__).parent
-local_folder = current_dir / "testing_area"
-local_folder_string = str(local_folder.resolve())
+from technical_indicators import bitcoin_closing_prices, bq_client, etl_state, indicator_engine, local_store, query_backend, table_snapshot, tracing
 
 
 destination_table = "btc_bollinger_bands"
 
+depends_on = ["bitcoin_closing_prices"]
+
 logger = logging.getLogger(__name__)
 
-def calculate_bollinger_bands(credentials) -> tuple[pd.DataFrame, int]:
-    client = bigquery.Client(credentials=credentials, project=credentials.project_id)
+def fetch_prices(credentials, prices: pd.DataFrame | None = None) -> tuple[pd.DataFrame, int]:
+    """
+    closed bitcoin prices, oldest first. prices is the bitcoin_price table published by this run,
+    when given the query is skipped
+    """
+    if prices is not None:
+        df = table_snapshot.closed_rows(prices, 'timestamp')[['timestamp', 'price']].copy()
+        return df, 0
 
     query = """
     SELECT 
@@ -29,32 +31,45 @@ def calculate_bollinger_bands(credentials) -> tuple[pd.DataFrame, int]:
         timestamp ASC
     """
 
-    query_job = client.query(query)
-    results = query_job.result()
-    df = results.to_dataframe()
-    bytes_processed = query_job.total_bytes_processed
-    logger.info(f"Query processed {bytes_processed:,} bytes ({bytes_processed / 1024 / 1024:.2f} MB)")
+    return query_backend.run_query(credentials, query)
 
-    # Calculate 20-period Simple Moving Average (Middle Band)
-    df['middle_band'] = df['price'].rolling(window=20).mean()
+def calculate_bollinger_bands(credentials, prices: pd.DataFrame | None = None) -> tuple[pd.DataFrame, int]:
+    """
+    prices is the bitcoin_price table published by this run, when given the query is skipped
+    """
+    df, bytes_processed = fetch_prices(credentials, prices)
+    bollinger_result, _ = compute_bollinger_bands(df)
 
-    # Calculate 20-period Standard Deviation
-    df['std_dev'] = df['price'].rolling(window=20).std()
+    return bollinger_result, bytes_processed
 
-    # Calculate Upper and Lower Bands (2 standard deviations)
-    df['upper_band'] = df['middle_band'] + (2 * df['std_dev'])
-    df['lower_band'] = df['middle_band'] - (2 * df['std_dev'])
+@tracing.traced('transform')
+def compute_bollinger_bands(df: pd.DataFrame, window: int = 20, previous: dict | None = None) -> tuple[pd.DataFrame, dict | None]:
+    """
+    bands for the price rows in df. previous holds the persisted trailing prices, which complete
+    the first windows of an incremental run. also returns the state at the last final row
+    """
+    prices = indicator_engine.as_price_array(df['price'])
+    history = previous['window_prices'] if previous else []
+    values = np.concatenate([history, prices])
 
-    # Calculate Bollinger Band Width (optional indicator)
-    df['bb_width'] = df['upper_band'] - df['lower_band']
+    # Middle band is the 20-period SMA, upper and lower bands sit 2 standard deviations away,
+    # plus the band width and %B (position within the bands)
+    bands = indicator_engine.bollinger(values, window=window, width=2)
 
-    # Calculate %B (position within bands, optional)
-    df['percent_b'] = (df['price'] - df['lower_band']) / (df['upper_band'] - df['lower_band'])
+    bollinger_result = df[['timestamp', 'price']].copy()
+    for column, column_values in bands.items():
+        bollinger_result[column] = column_values[len(history):]
 
-    # Return Bollinger Bands components with timestamp
-    bollinger_result = df[['timestamp', 'price', 'middle_band', 'upper_band', 'lower_band', 'bb_width', 'percent_b']].copy()
+    index = etl_state.checkpoint_index(len(df))
+    if index is None:
+        return bollinger_result, None
 
-    return bollinger_result, bytes_processed
+    state = {
+        'last_date': pd.Timestamp(df['timestamp'].iloc[index]).date().isoformat(),
+        'window_prices': etl_state.trailing_window(values, len(history) + index, window - 1)
+    }
+
+    return bollinger_result, state
 
 def schema() -> list[dict]:
     """
@@ -69,33 +84,50 @@ def schema() -> list[dict]:
     ]
     return table_schema
 
-def run_etl(credentials, dataset: str, mode: str) -> int:
+def extract(credentials, dataset: str, mode: str) -> dict:
+    """
+    price rows after the persisted checkpoint on incremental runs, otherwise all closed prices
+    """
+    if mode == 'prod' and etl_state.incremental_enabled():
+        return etl_state.extract_incremental(credentials, dataset, destination_table, bitcoin_closing_prices.prices_after)
+
+    df, bytes_processed = fetch_prices(credentials, prices=table_snapshot.get("bitcoin_price"))
+    return {'rows': df, 'bytes_processed': bytes_processed}
+
+def transform(payload: dict) -> dict:
+    if payload.get('incremental'):
+        return etl_state.transform_incremental(payload, compute_bollinger_bands)
+
+    table, _ = compute_bollinger_bands(payload['rows'])
+    return {'table': table, 'bytes_processed': payload['bytes_processed']}
+
+def load(credentials, dataset: str, mode: str, payload: dict) -> int:
+
+    if payload.get('incremental'):
+        return etl_state.load_incremental(credentials, dataset, destination_table, schema(), payload)
+
+    table, bytes_processed = payload['table'], payload['bytes_processed']
 
     if mode == 'prod':
 
-        table, bytes_processed = calculate_bollinger_bands(credentials)
         table_schema = schema()
         target_table = dataset + destination_table
 
-        pandas_gbq.to_gbq(
+        bq_client.merge_rows(
             dataframe=table,
             destination_table=target_table,
-            project_id="connection-123",
             table_schema=table_schema,
             credentials=credentials,
-            if_exists="replace"
+            key_columns=['timestamp']
         )
 
         return bytes_processed
 
     else:
         print('test mode')
-        table, bytes_processed = calculate_bollinger_bands(credentials)
-        # Create subdirectory if it doesn't exist
-        subdir = local_folder / calculate_bollinger_bands.__name__
-        subdir.mkdir(parents=True, exist_ok=True)
-
-        csv_filename = os.path.join(str(subdir), "data.csv")
-        table.to_csv(csv_filename, index=False)
-        print(f'Data saved to {csv_filename}')
+        path = local_store.write(destination_table, table, schema(), 'timestamp')
+        print(f'Data saved to {path}')
         return bytes_processed
+
+def run_etl(credentials, dataset: str, mode: str) -> int:
+    return load(credentials, dataset, mode, transform(extract(credentials, dataset, mode)))
@@ -0,0 +1,313 @@
+import io
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.api_core.exceptions import NotFound
+from google.auth.transport.requests import Request
+from google.cloud import bigquery, bigquery_storage
+from google.oauth2 import service_account
+
+from technical_indicators import job_ledger, local_store, table_layout, tracing
+
+project_id = "connection-123"
+
+# Seconds merge_rows waits for other load workers before flushing their tables as one batch
+batch_window = float(os.getenv("BQ_LOAD_BATCH_WINDOW", "0.5"))
+
+logger = logging.getLogger(__name__)
+
+# Process-wide registries, guarded because jobs run on a thread pool
+_lock = threading.Lock()
+_credentials = {}
+_clients = {}
+_read_clients = {}
+_batches = {}
+# merge_rows calls in progress, a batch only waits for others while there are some
+_loading = 0
+
+
+def get_credentials(credentials_path: str) -> service_account.Credentials:
+    """
+    load the service account once per process and refresh its OAuth token up front.
+    the credentials are scoped already, so every client shares this object and its cached token
+    """
+    with _lock:
+        credentials = _credentials.get(credentials_path)
+        if credentials is None:
+            credentials = service_account.Credentials.from_service_account_file(
+                credentials_path,
+                scopes=bigquery.Client.SCOPE
+            )
+            credentials.refresh(Request())
+            _credentials[credentials_path] = credentials
+            logger.info(f"Authenticated service account {credentials.service_account_email}")
+
+    return credentials
+
+
+def get_client(credentials, project: str = project_id) -> bigquery.Client:
+    """
+    shared bigquery client for the given credentials and project
+    """
+    key = (id(credentials), project)
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = bigquery.Client(credentials=credentials, project=project)
+            _clients[key] = client
+
+    return client
+
+
+def get_read_client(credentials) -> bigquery_storage.BigQueryReadClient:
+    """
+    shared Storage Read API client, query results are streamed through it as arrow record batches
+    """
+    key = id(credentials)
+
+    with _lock:
+        client = _read_clients.get(key)
+        if client is None:
+            client = bigquery_storage.BigQueryReadClient(credentials=credentials)
+            _read_clients[key] = client
+
+    return client
+
+
+def load_schema(dataframe: pd.DataFrame, table_schema: list[dict]) -> tuple[pd.DataFrame, list[dict]]:
+    """
+    schema fields for the columns present in the frame, like pandas_gbq the schema only
+    overrides those. STRING columns are cast so pyarrow does not infer another type
+    """
+    schema = [field for field in table_schema if field['name'] in dataframe.columns]
+
+    string_columns = [field['name'] for field in schema
+                      if field['type'].upper() == 'STRING' and not pd.api.types.is_string_dtype(dataframe[field['name']])]
+    if string_columns:
+        dataframe = dataframe.astype({name: "string" for name in string_columns})
+
+    return dataframe, schema
+
+
+def merge_query(target_id: str, staging_id: str, columns: list[str], key_columns: list[str]) -> str:
+    """
+    keyed MERGE of the staging table into the target. matched rows are only updated when a value
+    changed, so unchanged days are not rewritten
+    """
+    values = [f"`{column}`" for column in columns if column not in key_columns]
+    key_columns = [f"`{column}`" for column in key_columns]
+    columns = [f"`{column}`" for column in columns]
+
+    on = " AND ".join(f"t.{column} = s.{column}" for column in key_columns)
+
+    query = f"""
+        MERGE `{target_id}` t
+        USING `{staging_id}` s
+        ON {on}
+    """
+    if values:
+        changed = " OR ".join(f"t.{column} IS DISTINCT FROM s.{column}" for column in values)
+        assignments = ", ".join(f"{column} = s.{column}" for column in values)
+        query += f"""
+        WHEN MATCHED AND ({changed}) THEN
+          UPDATE SET {assignments}
+        """
+    query += f"""
+        WHEN NOT MATCHED THEN
+          INSERT ({", ".join(columns)}) VALUES ({", ".join(f"s.{column}" for column in columns)})
+    """
+    return query
+
+
+def merge_rows(dataframe: pd.DataFrame, destination_table: str, table_schema: list[dict], credentials,
+               key_columns: list[str], project: str = project_id, partition_field: str | None = None,
+               description: str | None = None) -> int:
+    """
+    upsert dataframe into destination_table on key_columns. the rows are loaded into a staging table
+    and merged, so only new or changed rows are written and the table stays readable meanwhile.
+    when the table does not exist yet it is created from dataframe, partitioned and clustered on
+    partition_field (default the first key column) as table_layout chooses. returns the number of rows inserted or updated.
+    while another load is in flight, calls from concurrent load workers are collected for batch_window
+    seconds and loaded as one batch. a lone load is flushed at once
+    """
+    global _loading
+
+    request = {
+        'dataframe': dataframe,
+        'destination_table': destination_table,
+        'table_schema': table_schema,
+        'key_columns': key_columns,
+        'partition_field': partition_field,
+        'description': description,
+        'record': job_ledger.current()
+    }
+    future = Future()
+
+    key = (id(credentials), project)
+
+    with tracing.span('load', table=destination_table, rows=len(dataframe)):
+        with _lock:
+            _loading += 1
+            batch = _batches.setdefault(key, [])
+            batch.append((request, future))
+            leader = len(batch) == 1
+            others = _loading > 1
+
+        try:
+            # The first caller of a batch flushes it for everybody, waiting for the others only
+            # when other loads are running
+            if leader:
+                try:
+                    if others:
+                        time.sleep(batch_window)
+                    with _lock:
+                        batch = _batches.pop(key)
+
+                    with tracing.span('merge_batch', tables=len(batch)):
+                        results = merge_batch([request for request, _ in batch], credentials, project)
+                    for (_, waiting), result in zip(batch, results):
+                        if isinstance(result, Exception):
+                            waiting.set_exception(result)
+                        else:
+                            waiting.set_result(result)
+                except BaseException as e:
+                    # The followers wait on their futures, none of them may be left unresolved
+                    with _lock:
+                        if _batches.get(key) is batch:
+                            _batches.pop(key)
+                    for _, waiting in batch:
+                        if not waiting.done():
+                            waiting.set_exception(e)
+                    raise
+
+            return future.result()
+        finally:
+            with _lock:
+                _loading -= 1
+
+
+def bigquery_type(arrow_type: pa.DataType) -> str:
+    if pa.types.is_timestamp(arrow_type):
+        return 'TIMESTAMP'
+    if pa.types.is_date(arrow_type):
+        return 'DATE'
+    if pa.types.is_boolean(arrow_type):
+        return 'BOOL'
+    if pa.types.is_integer(arrow_type):
+        return 'INT64'
+    if pa.types.is_floating(arrow_type):
+        return 'FLOAT64'
+    return 'STRING'
+
+
+def to_parquet(dataframe: pd.DataFrame, schema: list[dict]) -> tuple[io.BytesIO, list[dict]]:
+    """
+    dataframe serialized in memory as parquet, columns typed after the BigQuery schema.
+    also returns the schema of every column, the ones not declared get the type they were written with
+    """
+    with tracing.span('serialize', rows=len(dataframe)) as attributes:
+        table = local_store.to_arrow(dataframe, schema)
+        declared = {field['name']: field for field in schema}
+        fields = [declared.get(field.name, {'name': field.name, 'type': bigquery_type(field.type)})
+                  for field in table.schema]
+
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer, coerce_timestamps='us', allow_truncated_timestamps=True)
+        attributes['bytes'] = buffer.tell()
+
+    buffer.seek(0)
+    return buffer, fields
+
+
+def merge_batch(requests: list[dict], credentials, project: str = project_id) -> list[int | Exception]:
+    """
+    merge_rows for several tables at once. the parquet load jobs of all tables are submitted
+    together and awaited, then all MERGE statements. returns the affected rows per request,
+    or the exception that request failed with
+    """
+    client = get_client(credentials, project)
+    results = [None] * len(requests)
+    loads, merges, staging_tables = {}, {}, []
+
+    try:
+        for index, request in enumerate(requests):
+            try:
+                destination_table, key_columns = request['destination_table'], request['key_columns']
+                dataframe, schema = load_schema(request['dataframe'], request['table_schema'])
+                target_id = f"{project}.{destination_table}"
+
+                # MERGE fails when several source rows match one target row, the latest reading of a key wins
+                duplicated = dataframe.duplicated(subset=key_columns, keep='last')
+                if duplicated.any():
+                    logger.warning(f"{destination_table}: dropped {int(duplicated.sum())} rows with a duplicate key")
+                    dataframe = dataframe[~duplicated]
+
+                source, fields = to_parquet(dataframe, schema)
+                job_config = bigquery.LoadJobConfig(schema=fields, source_format=bigquery.SourceFormat.PARQUET)
+
+                try:
+                    client.get_table(target_id)
+                except NotFound:
+                    job_config.write_disposition = bigquery.WriteDisposition.WRITE_EMPTY
+                    job_config.destination_table_description = request['description']
+                    date_column = request['partition_field'] or key_columns[0]
+                    table_layout.apply(job_config, table_layout.choose_layout(dataframe, schema, date_column))
+                    load_id = target_id
+                else:
+                    job_config.write_disposition = bigquery.WriteDisposition.WRITE_TRUNCATE
+                    load_id = f"{target_id}_staging_{uuid.uuid4().hex[:8]}"
+                    staging_tables.append(load_id)
+
+                job = client.load_table_from_file(source, load_id, job_config=job_config)
+                loads[index] = (job, load_id, target_id, list(dataframe.columns), len(dataframe))
+            except Exception as e:
+                results[index] = e
+
+        # Every load is in flight at this point, they are only awaited now
+        for index, (job, load_id, target_id, columns, rows) in loads.items():
+            destination_table = requests[index]['destination_table']
+            try:
+                with tracing.span('upload', table=destination_table, rows=rows):
+                    job.result()
+            except Exception as e:
+                results[index] = e
+                continue
+            job_ledger.add_load(job, requests[index]['record'])
+
+            if load_id == target_id:
+                logger.info(f"{job.output_rows} out of {rows} rows loaded to new table {destination_table}")
+                results[index] = job.output_rows
+            else:
+                query = merge_query(target_id, load_id, columns, requests[index]['key_columns'])
+                merges[index] = (client.query(query), rows)
+
+        for index, (query_job, rows) in merges.items():
+            destination_table = requests[index]['destination_table']
+            try:
+                with tracing.span('merge', table=destination_table, rows=rows):
+                    query_job.result()
+            except Exception as e:
+                results[index] = e
+                continue
+            job_ledger.add_query(query_job, requests[index]['record'])
+
+            affected = query_job.num_dml_affected_rows or 0
+            logger.info(f"{affected} out of {rows} rows inserted or updated in {destination_table}")
+            results[index] = affected
+    finally:
+        # Cleanup is best effort, a leftover staging table must not replace the results
+        for staging_id in staging_tables:
+            try:
+                client.delete_table(staging_id, not_found_ok=True)
+            except Exception as e:
+                logger.warning(f"Staging table {staging_id} not deleted: {e}")
+
+    return results
@@ -1,51 +1,74 @@
+import numpy as np
 import pandas as pd
-import pandas_gbq
-from google.cloud import bigquery
 import logging
-from pathlib import Path
-import os
+from technical_indicators import bitcoin_closing_prices, bq_client, etl_state, indicator_engine, local_store, query_backend, table_snapshot, tracing
 
-current_dir = Path(__file__).parent
-local_folder = current_dir / "testing_area"
-local_folder_string = str(local_folder.resolve())
 
 destination_table = "btc_moving_averages"
 
+depends_on = ["bitcoin_closing_prices"]
+
 logger = logging.getLogger(__name__)
 
-def calculate_ma(credentials) -> tuple[pd.DataFrame, int]:
-   
-    client = bigquery.Client(credentials=credentials, project=credentials.project_id)
+def fetch_prices(credentials, prices: pd.DataFrame | None = None) -> tuple[pd.DataFrame, int]:
+    """
+    closed bitcoin prices, oldest first. prices is the bitcoin_price table published by this run,
+    when given the query is skipped
+    """
+    if prices is not None:
+        return table_snapshot.closed_rows(prices, 'timestamp')[['timestamp', 'price']], 0
 
     query = """
-        SELECT 
-      timestamp AS date_,
-      price,
-      AVG(price) OVER (
-        ORDER BY timestamp 
-        ROWS BETWEEN 9 PRECEDING AND CURRENT ROW
-      ) AS sma_10,
-      AVG(price) OVER (
-        ORDER BY timestamp 
-        ROWS BETWEEN 19 PRECEDING AND CURRENT ROW
-      ) AS sma_20,
-      AVG(price) OVER (
-        ORDER BY timestamp 
-        ROWS BETWEEN 49 PRECEDING AND CURRENT ROW
-      ) AS sma_50
+    SELECT
+      timestamp,
+      price
     FROM `connection-123.signals.bitcoin_price`
     WHERE timestamp < CURRENT_DATE()
-    ORDER BY timestamp DESC
+    ORDER BY timestamp
     """
-    query_job = client.query(query)
-    results = query_job.result()
-    mas = results.to_dataframe()
 
-    bytes_processed = query_job.total_bytes_processed
-    logger.info(f"Query processed {bytes_processed:,} bytes ({bytes_processed / 1024 / 1024:.2f} MB)")
+    return query_backend.run_query(credentials, query)
+
+def calculate_ma(credentials, prices: pd.DataFrame | None = None) -> tuple[pd.DataFrame, int]:
+    """
+    prices is the bitcoin_price table published by this run, when given the query is skipped.
+    the window averages are computed in memory with the SQL ROWS BETWEEN semantics
+    """
+    df, bytes_processed = fetch_prices(credentials, prices)
+    mas, _ = compute_ma(df)
 
     return mas, bytes_processed
 
+@tracing.traced('transform')
+def compute_ma(df: pd.DataFrame, windows=[10, 20, 50], previous: dict | None = None) -> tuple[pd.DataFrame, dict | None]:
+    """
+    window averages for the price rows in df (oldest first), newest first like the table.
+    previous holds the persisted trailing prices that the first windows of an incremental run reach back to.
+    also returns the state at the last final row
+    """
+    prices = indicator_engine.as_price_array(df['price'])
+    history = previous['window_prices'] if previous else []
+    values = np.concatenate([history, prices])
+
+    mas = df[['timestamp', 'price']].rename(columns={'timestamp': 'date_'})
+
+    # ROWS BETWEEN n-1 PRECEDING AND CURRENT ROW averages over a partial window at the start
+    for window in windows:
+        mas[f'sma_{window}'] = indicator_engine.sma(values, window, min_periods=1)[len(history):]
+
+    mas = mas.sort_values('date_', ascending=False).reset_index(drop=True)
+
+    index = etl_state.checkpoint_index(len(df))
+    if index is None:
+        return mas, None
+
+    state = {
+        'last_date': pd.Timestamp(df['timestamp'].iloc[index]).date().isoformat(),
+        'window_prices': etl_state.trailing_window(values, len(history) + index, max(windows) - 1)
+    }
+
+    return mas, state
+
 def schema() -> list[dict]:
     """
     create the schema for the bq table
@@ -59,34 +82,50 @@ def schema() -> list[dict]:
     ]
     return table_schema
 
-def run_etl(credentials,dataset:str,mode:str) -> int:
+def extract(credentials, dataset: str, mode: str) -> dict:
+    """
+    price rows after the persisted checkpoint on incremental runs, otherwise all closed prices
+    """
+    if mode == 'prod' and etl_state.incremental_enabled():
+        return etl_state.extract_incremental(credentials, dataset, destination_table, bitcoin_closing_prices.prices_after)
+
+    df, bytes_processed = fetch_prices(credentials, prices=table_snapshot.get("bitcoin_price"))
+    return {'rows': df, 'bytes_processed': bytes_processed}
+
+def transform(payload: dict) -> dict:
+    if payload.get('incremental'):
+        return etl_state.transform_incremental(payload, compute_ma)
+
+    table, _ = compute_ma(payload['rows'])
+    return {'table': table, 'bytes_processed': payload['bytes_processed']}
+
+def load(credentials, dataset: str, mode: str, payload: dict) -> int:
+
+    if payload.get('incremental'):
+        return etl_state.load_incremental(credentials, dataset, destination_table, schema(), payload, date_column='date_')
+
+    table, bytes_processed = payload['table'], payload['bytes_processed']
 
     if mode == 'prod':
 
-        table, bytes_processed = calculate_ma(credentials)
         table_schema = schema()
         target_table = dataset + destination_table
 
-        pandas_gbq.to_gbq(
+        bq_client.merge_rows(
             dataframe=table,
             destination_table=target_table,
-            project_id="connection-123",
             table_schema=table_schema,
             credentials=credentials,
-            if_exists="replace"
+            key_columns=['date_']
         )
 
         return bytes_processed
 
     else:
         print('test mode')
-        table, bytes_processed = calculate_ma(credentials)
-        # Create subdirectory if it doesn't exist
-        subdir = local_folder / calculate_ma.__name__
-        subdir.mkdir(parents=True, exist_ok=True)
-
-        csv_filename = os.path.join(str(subdir), "data.csv")
-        table.to_csv(csv_filename, index=False)
-        print(f'Data saved to {csv_filename}')
+        path = local_store.write(destination_table, table, schema(), 'date_')
+        print(f'Data saved to {path}')
         return bytes_processed
 
+def run_etl(credentials, dataset: str, mode: str) -> int:
+    return load(credentials, dataset, mode, transform(extract(credentials, dataset, mode)))
@@ -0,0 +1,133 @@
+import pandas as pd
+import logging
+from datetime import date
+from technical_indicators import local_store, query_backend, watermark
+
+
+destination_table = "btc_signals"
+
+depends_on = ["bitcoin_closing_prices", "btc_moving_averages", "bitcoin_ema", "rsi", "macd", "bollinger_bands"]
+
+logger = logging.getLogger(__name__)
+
+indicator_tables = {
+    'ma': ('btc_moving_averages', 'date_'),
+    'ema': ('btc_ema', 'timestamp'),
+    'rsi': ('btc_rsi', 'timestamp'),
+    'macd': ('btc_macd', 'timestamp'),
+    'bb': ('btc_bollinger_bands', 'timestamp')
+}
+
+def signals_query(start: date | None = None) -> str:
+    """
+    bitcoin prices joined with every indicator on the date. from start onwards when given,
+    the filter is repeated on each joined table so only the partitions it covers are scanned
+    """
+    joins = ""
+    for alias, (table, date_column) in indicator_tables.items():
+        joins += f"\n    LEFT JOIN `connection-123.signals.{table}` {alias}\n        ON p.timestamp = {alias}.{date_column}"
+        if start is not None:
+            joins += f" AND {alias}.{date_column} >= @start"
+
+    query = f"""
+    SELECT
+        p.timestamp AS date_,
+        p.price,
+        p.market_cap,
+        p.total_volume,
+        ma.sma_10,
+        ma.sma_20,
+        ma.sma_50,
+        ema.ema_9,
+        ema.ema_12,
+        ema.ema_26,
+        ema.ema_20,
+        ema.ema_50,
+        ema.ema_200,
+        rsi.rsi_14,
+        macd.macd_line,
+        macd.signal_line,
+        macd.histogram,
+        bb.middle_band,
+        bb.upper_band,
+        bb.lower_band,
+        bb.bb_width,
+        bb.percent_b
+    FROM `connection-123.signals.bitcoin_price` p{joins}
+    WHERE p.timestamp < CURRENT_DATE(){" AND p.timestamp >= @start" if start is not None else ""}
+    ORDER BY p.timestamp
+    """
+    return query
+
+def fetch_signals(credentials, start: date | None = None) -> tuple[pd.DataFrame, int]:
+    """
+    one row per closed day with the price and all indicators, only from start onwards when given
+    """
+    params = {'start': start} if start is not None else None
+    df, bytes_processed = query_backend.run_query(credentials, signals_query(start), params)
+
+    logger.info(f"joined {len(df)} rows of indicators")
+
+    return df, bytes_processed
+
+def schema() -> list[dict]:
+    """
+    create the schema for the bq table
+    """
+    table_schema = [
+        {'name': 'date_', 'type': 'DATE', 'description': 'The date of the closing price'},
+        {'name': 'price', 'type': 'FLOAT64', 'description': 'closing price'},
+        {'name': 'market_cap', 'type': 'FLOAT64', 'description': 'market cap for the daily timeframe'},
+        {'name': 'total_volume', 'type': 'FLOAT64', 'description': 'total volume of transactions happened daily'},
+        {'name': 'sma_10', 'type': 'FLOAT64', 'description': '10 day simple moving average'},
+        {'name': 'sma_20', 'type': 'FLOAT64', 'description': '20 day simple moving average'},
+        {'name': 'sma_50', 'type': 'FLOAT64', 'description': '50 day simple moving average'},
+        {'name': 'ema_9', 'type': 'FLOAT64', 'description': '9 day exponential moving average'},
+        {'name': 'ema_12', 'type': 'FLOAT64', 'description': '12 day exponential moving average'},
+        {'name': 'ema_26', 'type': 'FLOAT64', 'description': '26 day exponential moving average'},
+        {'name': 'ema_20', 'type': 'FLOAT64', 'description': '20 day exponential moving average'},
+        {'name': 'ema_50', 'type': 'FLOAT64', 'description': '50 day exponential moving average'},
+        {'name': 'ema_200', 'type': 'FLOAT64', 'description': '200 day exponential moving average'},
+        {'name': 'rsi_14', 'type': 'FLOAT64', 'description': 'rsi indicator 14 periods'},
+        {'name': 'macd_line', 'type': 'FLOAT64', 'description': 'ema 12 minus ema 26'},
+        {'name': 'signal_line', 'type': 'FLOAT64', 'description': '9 day ema of the macd line'},
+        {'name': 'histogram', 'type': 'FLOAT64', 'description': 'macd line minus signal line'},
+        {'name': 'middle_band', 'type': 'FLOAT64', 'description': 'bollinger middle band'},
+        {'name': 'upper_band', 'type': 'FLOAT64', 'description': 'bollinger upper band'},
+        {'name': 'lower_band', 'type': 'FLOAT64', 'description': 'bollinger lower band'},
+        {'name': 'bb_width', 'type': 'FLOAT64', 'description': 'bollinger band width'},
+        {'name': 'percent_b', 'type': 'FLOAT64', 'description': 'position of the price within the bands'}
+    ]
+    return table_schema
+
+def extract(credentials, dataset: str, mode: str) -> dict:
+    """
+    on incremental prod runs only the days past the watermark are joined again
+    """
+    start = None
+    if mode == 'prod':
+        start = watermark.fetch_start(watermark.load(credentials, dataset, destination_table))
+
+    table, bytes_processed = fetch_signals(credentials, start)
+    return {'table': table, 'start': start, 'bytes_processed': bytes_processed}
+
+def load(credentials, dataset: str, mode: str, payload: dict) -> int:
+    table, bytes_processed = payload['table'], payload['bytes_processed']
+
+    if mode == 'prod':
+
+        watermark.write(
+            credentials, dataset, destination_table, table, schema(), 'date_',
+            description="bitcoin price with all technical indicators, one row per closed day"
+        )
+
+        return bytes_processed
+
+    else:
+        print('test mode')
+        path = local_store.write(destination_table, table, schema(), 'date_')
+        print(f'Data saved to {path}')
+        return bytes_processed
+
+def run_etl(credentials, dataset: str, mode: str) -> int:
+    return load(credentials, dataset, mode, extract(credentials, dataset, mode))
@@ -1,23 +1,22 @@
 import json
-import os
-import requests
 import pandas as pd
 from pathlib import Path
+from google.api_core.exceptions import NotFound
 from google.cloud import bigquery
-import os
+from technical_indicators import bq_client, http_client, job_ledger, local_store, table_layout, tracing
 
 current_dir = Path(__file__).parent
 api_key_path = current_dir.parent / "cmc.txt"
 api_key_path_str = str(api_key_path.resolve())
 
-local_folder = current_dir / "testing_area"
-local_folder_string = str(local_folder.resolve())
-
 with open(api_key_path_str, 'r') as f:
     api_key = f.read().strip()
 
 destination_table = "cmc_data"
 
+depends_on = []
+
+@tracing.traced('fetch')
 def fetch_cmc_data() -> pd.DataFrame:
 
     url = 'https://pro-api.coinmarketcap.com/v1/global-metrics/quotes/latest'
@@ -26,7 +25,7 @@ def fetch_cmc_data() -> pd.DataFrame:
         'X-CMC_PRO_API_KEY': api_key,
         'Accept': 'application/json'
     }
-    response = requests.get(url, headers=headers)
+    response = http_client.get(url, headers=headers)
     response.raise_for_status()
     df = pd.json_normalize(response.json(), sep='_')
 
@@ -75,27 +74,32 @@ def schema() -> list[dict]:
     ]
     return table_schema
 
-def run_etl(credentials, dataset:str, mode:str) -> int:
+def extract(credentials, dataset: str, mode: str) -> dict:
+    return {'table': fetch_cmc_data(), 'bytes_processed': 0}
+
+def load(credentials, dataset: str, mode: str, payload: dict) -> int:
+    table = payload['table']
 
     if mode == 'prod':
 
         project = "connection-123"
-        client = bigquery.Client(credentials=credentials, project=project)
-        table = fetch_cmc_data()
+        client = bq_client.get_client(credentials, project=project)
         table_schema = schema()
 
         job_config = bigquery.LoadJobConfig(
             schema=table_schema,
             write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
-            time_partitioning=bigquery.TimePartitioning(
-                type_=bigquery.TimePartitioningType.DAY,
-                field="status_timestamp"
-            ),
             destination_table_description="Global snapshot of CoinMarketCap aggregated metrics (market caps, 24h volumes, dominance and sector-specific caps) quoted in USD. One row per API response"
         )
 
         table_ref = dataset + destination_table
 
+        # Appends must match the partitioning of the existing table, the layout is only set on creation
+        try:
+            client.get_table(table_ref)
+        except NotFound:
+            table_layout.apply(job_config, table_layout.choose_layout(table, table_schema, 'status_timestamp'))
+
         job = client.load_table_from_dataframe(
             table,
             table_ref,
@@ -103,18 +107,15 @@ def run_etl(credentials, dataset:str, mode:str) -> int:
         )
 
         job.result()
+        job_ledger.add_load(job)
 
         return 0
 
     else:
         print('test mode')
-        table = fetch_cmc_data()
-        # Create subdirectory if it doesn't exist
-        subdir = local_folder / fetch_cmc_data.__name__
-        subdir.mkdir(parents=True, exist_ok=True)
-
-        csv_filename = os.path.join(str(subdir), "data.csv")
-        table.to_csv(csv_filename, index=False)
-        print(f'Data saved to {csv_filename}')
+        path = local_store.write(destination_table, table, schema(), 'status_timestamp')
+        print(f'Data saved to {path}')
         return 0
 
+def run_etl(credentials, dataset: str, mode: str) -> int:
+    return load(credentials, dataset, mode, extract(credentials, dataset, mode))
@@ -1,9 +1,9 @@
-import requests
 import pandas as pd
 from typing import  Dict, Optional, Any
 import logging
+from datetime import date
 from pathlib import Path
-from google.cloud import bigquery
+from technical_indicators import http_client, watermark
 
 current_dir = Path(__file__).parent
 
@@ -20,6 +20,11 @@ base_url = "https://api.stlouisfed.org/fred/"
 
 destination_table = "cpi_data"
 
+# Monthly readings, the last few months are revised after publication
+cpi_overlap_days = 92
+
+depends_on = []
+
 logger = logging.getLogger(__name__)
 
 def fred_request(endpoint: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
@@ -30,7 +35,7 @@ def fred_request(endpoint: str, params: Optional[Dict[str, Any]] = None) -> Opti
     params['file_type'] = 'json'
 
     url = base_url + endpoint
-    response = requests.get(url, params=params)
+    response = http_client.get(url, params=params)
 
     if response.status_code == 200:
         return response.json()
@@ -39,11 +44,14 @@ def fred_request(endpoint: str, params: Optional[Dict[str, Any]] = None) -> Opti
         print(response.text)
         return None
 
-def get_cpi_data(series_id: str = "CPILFESL") -> Optional[pd.DataFrame]:
+def get_cpi_data(series_id: str = "CPILFESL", start: date | None = None) -> Optional[pd.DataFrame]:
+    """
+    monthly readings since 2023, or only from start onwards when the table is already loaded
+    """
     endpoint = "series/observations"
     params = {
         "series_id": series_id,
-        "observation_start": "2023-01-01",
+        "observation_start": start.isoformat() if start else "2023-01-01",
         "observation_end": "2028-12-31",  # Add explicit end date
         "frequency": "m",
         "units": "pc1",
@@ -74,36 +82,33 @@ def schema() -> list[dict]:
     ]
     return table_schema
 
-def run_etl(credentials,dataset:str,mode:str) -> None:
-
+def extract(credentials, dataset: str, mode: str) -> dict:
+    """
+    on incremental prod runs only the range past the watermark is fetched
+    """
+    start = None
     if mode == 'prod':
+        start = watermark.fetch_start(watermark.load(credentials, dataset, destination_table), overlap=cpi_overlap_days)
 
-        project = "connection-123"
-        client = bigquery.Client(credentials=credentials, project=project)
-        table = get_cpi_data()
-        table_schema = schema()
+    return {'table': get_cpi_data(start=start), 'start': start, 'bytes_processed': 0}
 
-        job_config = bigquery.LoadJobConfig(
-            schema=table_schema,
-            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-            time_partitioning=bigquery.TimePartitioning(
-                type_=bigquery.TimePartitioningType.DAY,
-                field="date"
-            ),
-            destination_table_description="CPI data monthly reading"
-        )
+def load(credentials, dataset: str, mode: str, payload: dict) -> None:
+    table = payload['table']
 
-        table_ref = dataset + destination_table
+    if mode == 'prod':
 
-        job = client.load_table_from_dataframe(
-            table,
-            table_ref,
-            job_config=job_config
-        )
+        table_schema = schema()
 
-        job.result()
+        watermark.write(
+            credentials, dataset, destination_table, table, table_schema, 'date',
+            partition_field="date",
+            description="CPI data monthly reading"
+        )
 
         return 0
 
     else:
         print('no production or test mode')
+
+def run_etl(credentials, dataset: str, mode: str) -> None:
+    return load(credentials, dataset, mode, extract(credentials, dataset, mode))
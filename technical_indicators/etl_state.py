@@ -0,0 +1,215 @@
+import json
+import logging
+import os
+import random
+import time
+from datetime import date
+from typing import Callable
+
+import numpy as np
+from google.api_core.exceptions import BadRequest, Conflict, NotFound
+from google.cloud import bigquery
+
+from technical_indicators import bq_client, job_ledger, table_snapshot
+
+state_table = "etl_state"
+
+# Trailing rows that the next run recomputes, the latest daily close is revised once the day is over
+revision_rows = 1
+
+# Load workers save their state in parallel, BigQuery aborts concurrent DML on the same table,
+# the state MERGE is retried with exponential, jittered backoff
+save_attempts = int(os.getenv('ETL_STATE_SAVE_ATTEMPTS', '5'))
+save_backoff = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def schema() -> list[dict]:
+    """
+    create the schema for the bq table
+    """
+    table_schema = [
+        {'name': 'name', 'type': 'STRING', 'description': 'owner of the state, usually a destination table'},
+        {'name': 'state', 'type': 'STRING', 'description': 'json document with the persisted values'},
+        {'name': 'updated_at', 'type': 'TIMESTAMP', 'description': 'when the state was last written'}
+    ]
+    return table_schema
+
+
+def incremental_enabled() -> bool:
+    """
+    incremental indicator updates are opt-in with ETL_INCREMENTAL=1
+    """
+    return os.getenv('ETL_INCREMENTAL') == '1'
+
+
+def load(credentials, dataset: str, name: str) -> dict | None:
+    """
+    persisted state for name, or None when nothing was saved yet
+    """
+    client = bq_client.get_client(credentials)
+
+    query = f"""
+        SELECT state
+        FROM `{bq_client.project_id}.{dataset}{state_table}`
+        WHERE name = @name
+        ORDER BY updated_at DESC
+        LIMIT 1
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter('name', 'STRING', name)]
+    )
+
+    try:
+        query_job = client.query(query, job_config=job_config)
+        rows = list(query_job.result())
+    except NotFound:
+        return None
+
+    job_ledger.add_query(query_job)
+
+    if not rows:
+        return None
+
+    return json.loads(rows[0]['state'])
+
+
+def concurrent_update(error: Exception) -> bool:
+    """
+    whether a DML statement failed only because another one changed the table at the same time
+    """
+    message = str(error).lower()
+    return isinstance(error, (BadRequest, Conflict)) and (
+        'could not serialize access' in message or 'concurrent update' in message)
+
+
+def save(credentials, dataset: str, name: str, state: dict) -> None:
+    """
+    upsert the state document for name. the MERGE only sets this name's row, so it is retried
+    when a concurrent save of another name aborts it
+    """
+    client = bq_client.get_client(credentials)
+    table_id = f"{bq_client.project_id}.{dataset}{state_table}"
+
+    client.create_table(bigquery.Table(table_id, schema=schema()), exists_ok=True)
+
+    query = f"""
+        MERGE `{table_id}` t
+        USING (SELECT @name AS name, @state AS state) s
+        ON t.name = s.name
+        WHEN MATCHED THEN
+          UPDATE SET state = s.state, updated_at = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN
+          INSERT (name, state, updated_at) VALUES (s.name, s.state, CURRENT_TIMESTAMP())
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter('name', 'STRING', name),
+            bigquery.ScalarQueryParameter('state', 'STRING', json.dumps(state, default=str))
+        ]
+    )
+
+    for attempt in range(1, save_attempts + 1):
+        query_job = client.query(query, job_config=job_config)
+        try:
+            query_job.result()
+            break
+        except (BadRequest, Conflict) as e:
+            if attempt == save_attempts or not concurrent_update(e):
+                raise
+            delay = save_backoff * 2 ** (attempt - 1) + random.uniform(0, save_backoff)
+            logger.warning(f"state of {name} not saved, concurrent update, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    job_ledger.add_query(query_job)
+    logger.info(f"saved state for {name}")
+
+
+def checkpoint_index(rows: int) -> int | None:
+    """
+    index of the last row that is final, its values seed the next incremental run.
+    None when every row is still open to revision
+    """
+    index = rows - 1 - revision_rows
+    return index if index >= 0 else None
+
+
+def last_date(state: dict | None) -> date:
+    """
+    date of the persisted checkpoint, date.min when there is no state so every row is new
+    """
+    if state is None:
+        return date.min
+
+    return date.fromisoformat(str(state['last_date']))
+
+
+def trailing_window(values: np.ndarray, end: int, size: int) -> list[float]:
+    """
+    the `size` values up to and including index end, what a rolling window needs to continue
+    """
+    return [float(value) for value in values[max(0, end - size + 1):end + 1]]
+
+
+def extract_incremental(credentials, dataset: str, destination_table: str, rows_after: Callable) -> dict:
+    """
+    persisted checkpoint of destination_table and the input rows after it.
+    rows_after(credentials, after) returns the input rows and bytes processed
+    """
+    state = load(credentials, dataset, destination_table)
+    rows, bytes_processed = rows_after(credentials, last_date(state))
+
+    return {'incremental': True, 'state': state, 'rows': rows, 'bytes_processed': bytes_processed}
+
+
+def transform_incremental(payload: dict, compute: Callable) -> dict:
+    """
+    compute(rows, previous) returns the output rows and the next checkpoint
+    """
+    table, checkpoint = None, None
+    if not payload['rows'].empty:
+        table, checkpoint = compute(payload['rows'], previous=payload['state'])
+
+    return {**payload, 'table': table, 'checkpoint': checkpoint}
+
+
+def load_incremental(credentials, dataset: str, destination_table: str, table_schema: list[dict], payload: dict,
+                     date_column: str = 'timestamp', publish: bool = False) -> int:
+    """
+    upsert the computed rows and persist the next checkpoint
+    """
+    state, table, checkpoint = payload['state'], payload['table'], payload['checkpoint']
+
+    if table is None:
+        logger.info(f"{destination_table}: no rows after {last_date(state)}")
+        return payload['bytes_processed']
+
+    bq_client.merge_rows(
+        dataframe=table,
+        destination_table=dataset + destination_table,
+        table_schema=table_schema,
+        credentials=credentials,
+        key_columns=[date_column]
+    )
+
+    if publish:
+        table_snapshot.publish(destination_table, table, complete=state is None)
+
+    if checkpoint is not None:
+        save(credentials, dataset, destination_table, checkpoint)
+
+    return payload['bytes_processed']
+
+
+def run_incremental(credentials, dataset: str, destination_table: str, table_schema: list[dict],
+                    rows_after: Callable, compute: Callable, date_column: str = 'timestamp',
+                    publish: bool = False) -> int:
+    """
+    compute and write only the rows after the persisted checkpoint of destination_table.
+    without state the whole table is computed once, which also creates the first checkpoint
+    """
+    payload = extract_incremental(credentials, dataset, destination_table, rows_after)
+    payload = transform_incremental(payload, compute)
+
+    return load_incremental(credentials, dataset, destination_table, table_schema, payload, date_column, publish)
@@ -1,20 +1,22 @@
 import pandas as pd
-import requests
-import pandas_gbq
-import os
 import logging
-from pathlib import Path
-current_dir = Path(__file__).parent
-local_folder = current_dir / "testing_area"
-local_folder_string = str(local_folder.resolve())
+from datetime import date
+from technical_indicators import http_client, local_store, tracing, watermark
 
 destination_table = "fear_greed"
 
+depends_on = []
+
 logger = logging.getLogger(__name__)
 
-def fetch_fear_greed_index(limit=365):
+@tracing.traced('fetch')
+def fetch_fear_greed_index(limit=365, start: date | None = None):
+    """
+    the last `limit` daily readings, or only those from start onwards when the table is already loaded
+    """
+    limit = watermark.days_since(start, default=limit)
     url = f"https://api.alternative.me/fng/?limit={limit}&format=json"
-    response = requests.get(url)
+    response = http_client.get(url)
     response.raise_for_status()
 
     data = response.json()
@@ -39,6 +41,9 @@ def fetch_fear_greed_index(limit=365):
         # Sort by date (newest first)
     df = df.sort_values('timestamp', ascending=False)
 
+    if start is not None:
+        df = df[df['timestamp'] >= start]
+
     return df[['value_classification','numeric_sentiment', 'timestamp']]
 
 def schema() -> list[dict]:
@@ -52,35 +57,34 @@ def schema() -> list[dict]:
     ]
     return table_schema
 
-def run_etl(credentials,dataset:str,mode:str) -> int:
+def extract(credentials, dataset: str, mode: str) -> dict:
+    """
+    on incremental prod runs only the range past the watermark is fetched
+    """
+    start = None
+    if mode == 'prod':
+        start = watermark.fetch_start(watermark.load(credentials, dataset, destination_table))
+
+    return {'table': fetch_fear_greed_index(start=start), 'start': start, 'bytes_processed': 0}
+
+def load(credentials, dataset: str, mode: str, payload: dict) -> int:
+    table = payload['table']
 
     if mode == 'prod':
 
-        table = fetch_fear_greed_index()
         table_schema = schema()
-        target_table = dataset + destination_table
 
-        pandas_gbq.to_gbq(
-            dataframe=table,
-            destination_table=target_table,
-            project_id="connection-123",
-            table_schema=table_schema,
-            credentials=credentials,
-            if_exists="replace"
-        )
+        watermark.write(credentials, dataset, destination_table, table, table_schema, 'timestamp')
 
         return 0
 
     else:
         print('test mode')
-        table = fetch_fear_greed_index()
 
-        # Create subdirectory if it doesn't exist
-        subdir = local_folder / fetch_fear_greed_index.__name__
-        subdir.mkdir(parents=True, exist_ok=True)
+        path = local_store.write(destination_table, table, schema(), 'timestamp')
+        print(f'Data saved to {path}')
 
-        csv_filename = os.path.join(str(subdir), "data.csv")
-        table.to_csv(csv_filename, index=False)
-        print(f'Data saved to {csv_filename}')
+        return 0
 
-        return 0
\ No newline at end of file
+def run_etl(credentials, dataset: str, mode: str) -> int:
+    return load(credentials, dataset, mode, extract(credentials, dataset, mode))
@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# STRING columns with at most this share of distinct values become categoricals
+category_ratio = 0.5
+
+
+def float32_enabled() -> bool:
+    """
+    ETL_FLOAT32=1 keeps the FLOAT64 columns of derived indicator tables as float32 until upload.
+    BigQuery still stores FLOAT64, the values are rounded to float32 precision
+    """
+    return os.getenv('ETL_FLOAT32') == '1'
+
+
+def cast(dataframe: pd.DataFrame, table_schema: list[dict], float32: bool = False) -> pd.DataFrame:
+    """
+    compact dtypes for the columns declared in table_schema: DATE as datetime64[s] (pandas has no
+    day unit), repeated STRING labels as categoricals and, when float32, FLOAT64 as float32.
+    other columns are left alone
+    """
+    types = {field['name']: field['type'].upper() for field in table_schema}
+    columns = {}
+
+    for name in dataframe.columns:
+        kind = types.get(name)
+        values = dataframe[name]
+
+        if kind == 'DATE' and not pd.api.types.is_datetime64_dtype(values):
+            columns[name] = pd.to_datetime(values).astype('datetime64[s]')
+        elif kind == 'STRING' and not isinstance(values.dtype, pd.CategoricalDtype) and len(values) \
+                and values.nunique(dropna=True) <= category_ratio * len(values):
+            columns[name] = values.astype('category')
+        elif kind in ('FLOAT64', 'FLOAT') and float32 and values.dtype == np.float64:
+            columns[name] = values.astype(np.float32)
+
+    if not columns:
+        return dataframe
+
+    return dataframe.assign(**columns)
+
+
+def cast_payload(payload: dict, table_schema: list[dict], float32: bool = False) -> dict:
+    """
+    cast the frames a stage hands to the next one, the source rows and the table to load
+    """
+    frames = {key: cast(payload[key], table_schema, float32) for key in ('rows', 'table')
+              if isinstance(payload.get(key), pd.DataFrame)}
+
+    return {**payload, **frames}
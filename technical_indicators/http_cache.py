@@ -0,0 +1,160 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+cache_dir = Path(os.getenv('HTTP_CACHE_DIR', Path(__file__).parent.parent / ".http_cache"))
+
+# Entries beyond this size are evicted least recently used first
+max_bytes = int(float(os.getenv('HTTP_CACHE_MAX_MB', '64')) * 1024 * 1024)
+
+# Seconds a response is served without asking the source again, hosts not listed are not cached
+host_ttls = {
+    'api.coingecko.com': 60 * 60,
+    'api.alternative.me': 60 * 60,
+    'community-api.coinmetrics.io': 6 * 60 * 60,
+    'api.stlouisfed.org': 12 * 60 * 60,
+    'pro-api.coinmarketcap.com': 15 * 60
+}
+
+# Query parameters carrying credentials, kept out of the cache keys and the stored metadata
+credential_params = {'api_key', 'apikey', 'key', 'token', 'access_token', 'cmc_pro_api_key'}
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    """
+    the cache is opt-in with HTTP_CACHE=1, main turns it on in local mode
+    """
+    return os.getenv('HTTP_CACHE') == '1'
+
+
+def ttl(url: str) -> int:
+    return host_ttls.get(urlsplit(url).hostname, 0)
+
+
+def is_credential(name: str) -> bool:
+    return str(name).lower() in credential_params
+
+
+def cache_key(url: str, params: dict | None) -> str:
+    """
+    hash of the url and its sorted query parameters, credentials left out so a rotated key
+    still finds its entries
+    """
+    items = sorted((str(key), str(value)) for key, value in (params or {}).items() if not is_credential(key))
+    return hashlib.sha256(json.dumps([redact(url), items]).encode()).hexdigest()
+
+
+def redact(url: str) -> str:
+    """
+    url without its credential query parameters
+    """
+    parts = urlsplit(url)
+    query = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True) if not is_credential(name)]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def lookup(key: str) -> tuple[dict, bytes] | None:
+    """
+    stored metadata and body for key, None when nothing is cached
+    """
+    meta_path = cache_dir / f"{key}.json"
+    body_path = cache_dir / f"{key}.body"
+
+    try:
+        meta = json.loads(meta_path.read_text())
+        body = body_path.read_bytes()
+    except (OSError, ValueError):
+        return None
+
+    # The body's mtime is the recency used for eviction
+    os.utime(body_path)
+
+    return meta, body
+
+
+def is_fresh(meta: dict) -> bool:
+    return time.time() - meta['stored_at'] < meta['ttl']
+
+
+def validators(meta: dict) -> dict:
+    """
+    conditional request headers from the ETag / Last-Modified the source sent
+    """
+    headers = {}
+    if meta['headers'].get('ETag'):
+        headers['If-None-Match'] = meta['headers']['ETag']
+    if meta['headers'].get('Last-Modified'):
+        headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+    return headers
+
+
+def store(key: str, response: requests.Response) -> None:
+    """
+    keep a successful response, then evict old entries beyond max_bytes
+    """
+    headers = {name: response.headers[name] for name in ('Content-Type', 'ETag', 'Last-Modified')
+               if name in response.headers}
+    meta = {
+        'url': redact(response.url),
+        'status_code': response.status_code,
+        'headers': headers,
+        'stored_at': time.time(),
+        'ttl': ttl(response.url)
+    }
+
+    with _lock:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        (cache_dir / f"{key}.body").write_bytes(response.content)
+        (cache_dir / f"{key}.json").write_text(json.dumps(meta))
+        evict()
+
+
+def refresh(key: str, meta: dict) -> None:
+    """
+    a 304 answer makes the stored body fresh again
+    """
+    meta['stored_at'] = time.time()
+
+    with _lock:
+        (cache_dir / f"{key}.json").write_text(json.dumps(meta))
+
+
+def evict() -> None:
+    """
+    drop least recently used entries until the cache fits max_bytes
+    """
+    bodies = sorted(cache_dir.glob("*.body"), key=lambda path: path.stat().st_mtime)
+    total = sum(path.stat().st_size for path in bodies)
+
+    for body_path in bodies:
+        if total <= max_bytes:
+            break
+        total -= body_path.stat().st_size
+        body_path.unlink(missing_ok=True)
+        body_path.with_suffix(".json").unlink(missing_ok=True)
+        logger.info(f"evicted {body_path.stem} from the http cache")
+
+
+def as_response(meta: dict, body: bytes) -> requests.Response:
+    """
+    rebuild a requests response from a cache entry
+    """
+    response = requests.Response()
+    response.status_code = meta['status_code']
+    response.headers = CaseInsensitiveDict(meta['headers'])
+    response.url = meta['url']
+    response._content = body
+
+    return response
@@ -0,0 +1,122 @@
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from technical_indicators import http_cache, job_ledger, openmetrics, tracing
+
+# (connect, read) timeouts in seconds, a hung source fails its job instead of stalling the run
+connect_timeout = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+read_timeout = float(os.getenv('HTTP_READ_TIMEOUT', '30'))
+
+# Rate limits and transient server errors are retried with exponential, jittered backoff
+retry_statuses = (429, 500, 502, 503, 504)
+max_retries = int(os.getenv('HTTP_MAX_RETRIES', '4'))
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_session = None
+
+
+def retry_policy() -> Retry:
+    """
+    retries for idempotent requests, honouring Retry-After on 429/503
+    """
+    return Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        status_forcelist=retry_statuses,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        backoff_factor=1,
+        backoff_jitter=1,
+        backoff_max=60,
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+
+
+def get_session() -> requests.Session:
+    """
+    process-wide session. connections to each host are pooled and kept alive across jobs,
+    so the TLS handshake with a source happens once per run
+    """
+    global _session
+
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=16,
+                pool_maxsize=int(os.getenv('ETL_EXTRACT_WORKERS', '4')) * 2,
+                max_retries=retry_policy()
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+            _session = session
+
+    return _session
+
+
+def get(url: str, params: dict | None = None, headers: dict | None = None,
+        timeout: tuple[float, float] | None = None) -> requests.Response:
+    """
+    GET through the shared session, bodies are decompressed transparently.
+    with the response cache on, fresh entries are served from disk and stale ones are
+    revalidated with the source's ETag / Last-Modified
+    """
+    with tracing.span('fetch', url=url) as attributes:
+        cached = None
+        if http_cache.enabled() and http_cache.ttl(url) > 0:
+            key = http_cache.cache_key(url, params)
+            cached = http_cache.lookup(key)
+
+        if cached is not None:
+            meta, body = cached
+            if http_cache.is_fresh(meta):
+                logger.info(f"{url} served from the http cache")
+                job_ledger.add(http_cache_hits=1)
+                openmetrics.inc('http_cache_requests', host=urlsplit(url).hostname, result='hit')
+                attributes.update(cache='hit', bytes=len(body))
+                return http_cache.as_response(meta, body)
+            headers = {**(headers or {}), **http_cache.validators(meta)}
+
+        start = time.perf_counter()
+        response = get_session().get(
+            url,
+            params=params,
+            headers=headers,
+            timeout=timeout or (connect_timeout, read_timeout)
+        )
+        host = urlsplit(url).hostname
+        openmetrics.observe('http_request_duration_seconds', time.perf_counter() - start, host=host)
+
+        job_ledger.add(http_requests=1, http_bytes=len(response.content))
+        attributes.update(status=response.status_code, bytes=len(response.content))
+
+        retries = response.raw.retries
+        if retries is not None and retries.history:
+            logger.info(f"{url} answered {response.status_code} after {len(retries.history)} retries")
+
+        if cached is not None and response.status_code == 304:
+            logger.info(f"{url} not modified, served from the http cache")
+            http_cache.refresh(key, meta)
+            job_ledger.add(http_cache_hits=1)
+            openmetrics.inc('http_cache_requests', host=host, result='revalidated')
+            attributes['cache'] = 'revalidated'
+            return http_cache.as_response(meta, body)
+
+        if http_cache.enabled() and http_cache.ttl(url) > 0:
+            openmetrics.inc('http_cache_requests', host=host, result='miss')
+            if response.status_code == 200:
+                http_cache.store(key, response)
+
+        return response
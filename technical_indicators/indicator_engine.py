@@ -0,0 +1,252 @@
+import numpy as np
+from scipy.signal import lfilter
+
+# Default parameters of the indicator tables
+ema_periods = [9, 12, 26, 20, 50, 200]
+sma_windows = [10, 20, 50]
+rsi_period = 14
+macd_fast, macd_slow, macd_signal = 12, 26, 9
+bollinger_window, bollinger_width = 20, 2
+
+
+def as_price_array(values) -> np.ndarray:
+    """
+    contiguous float64 view of a price column, copied only when the input is not one already
+    """
+    return np.ascontiguousarray(values, dtype=np.float64)
+
+
+def ema(values: np.ndarray, span: int, out: np.ndarray | None = None,
+        initial: float | None = None) -> np.ndarray:
+    """
+    exponential moving average, same as pandas ewm(span=span, adjust=False).mean().
+    the recurrence y[t] = alpha * x[t] + (1 - alpha) * y[t-1] runs as one IIR filter pass in C.
+    initial is y[-1] when continuing a series from persisted state, otherwise y[0] == x[0]
+    """
+    if out is None:
+        out = np.empty(len(values))
+    if len(values) == 0:
+        return out
+
+    alpha = 2.0 / (span + 1.0)
+    if initial is None:
+        initial = values[0]
+
+    filtered, _ = lfilter([alpha], [1.0, alpha - 1.0], values, zi=[(1.0 - alpha) * initial])
+    out[:] = filtered
+
+    return out
+
+
+def sma(values: np.ndarray, window: int, min_periods: int | None = None,
+        out: np.ndarray | None = None) -> np.ndarray:
+    """
+    simple moving average from a running sum, same as pandas rolling(window, min_periods).mean().
+    min_periods=1 matches the SQL `ROWS BETWEEN window-1 PRECEDING AND CURRENT ROW` average
+    """
+    n = len(values)
+    if out is None:
+        out = np.empty(n)
+    if n == 0:
+        return out
+    if min_periods is None:
+        min_periods = window
+
+    # Offsetting by the first price keeps the running sum small and the differences exact
+    shift = values[0]
+    running = np.cumsum(values - shift)
+
+    head = min(window, n)
+    np.divide(running[:head], np.arange(1, head + 1), out=out[:head])
+    np.subtract(running[window:], running[:-window], out=out[window:])
+    out[window:] /= window
+    out += shift
+
+    out[:min_periods - 1] = np.nan
+
+    return out
+
+
+def rolling_std(values: np.ndarray, window: int, mean: np.ndarray | None = None,
+                out: np.ndarray | None = None) -> np.ndarray:
+    """
+    sample standard deviation over full windows, same as pandas rolling(window).std().
+    squared deviations from the window mean are summed window by window offset, which keeps
+    the two-pass accuracy with only two scratch arrays
+    """
+    n = len(values)
+    if out is None:
+        out = np.empty(n)
+    out[:] = np.nan
+    if n < window:
+        return out
+
+    if mean is None:
+        mean = sma(values, window)
+
+    m = n - window + 1
+    centre = mean[window - 1:]
+    total = np.zeros(m)
+    scratch = np.empty(m)
+
+    for offset in range(window):
+        np.subtract(values[offset:offset + m], centre, out=scratch)
+        np.square(scratch, out=scratch)
+        total += scratch
+
+    total /= window - 1
+    np.sqrt(total, out=out[window - 1:])
+
+    return out
+
+
+def rsi_averages(values: np.ndarray, period: int = rsi_period,
+                 previous: tuple[float, float, float] | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    EMA-smoothed (span=period) average gain and loss of the price changes.
+    previous is (last price, average gain, average loss) when continuing from persisted state
+    """
+    n = len(values)
+    change = np.empty(n)
+    if n == 0:
+        return change, np.empty(0)
+
+    if previous is None:
+        change[0] = 0.0
+        initial_gain = initial_loss = None
+    else:
+        last_price, initial_gain, initial_loss = previous
+        change[0] = values[0] - last_price
+    np.subtract(values[1:], values[:-1], out=change[1:])
+
+    gain = np.maximum(change, 0.0)
+    loss = np.maximum(-change, 0.0, out=change)
+
+    avg_gain = ema(gain, period, out=gain, initial=initial_gain)
+    avg_loss = ema(loss, period, out=loss, initial=initial_loss)
+
+    return avg_gain, avg_loss
+
+
+def relative_strength(avg_gain: np.ndarray, avg_loss: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
+    """
+    100 - 100 / (1 + avg_gain / avg_loss)
+    """
+    if out is None:
+        out = np.empty(len(avg_gain))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(avg_gain, avg_loss, out=out)
+        out += 1.0
+        np.divide(100.0, out, out=out)
+        np.subtract(100.0, out, out=out)
+
+    return out
+
+
+def rsi(values: np.ndarray, period: int = rsi_period, out: np.ndarray | None = None,
+        previous: tuple[float, float, float] | None = None) -> np.ndarray:
+    """
+    relative strength index with gains and losses smoothed by an EMA of span=period,
+    the formula the btc_rsi table has always used
+    """
+    avg_gain, avg_loss = rsi_averages(values, period, previous)
+
+    return relative_strength(avg_gain, avg_loss, out=out)
+
+
+def macd(ema_fast: np.ndarray, ema_slow: np.ndarray, signal: int = macd_signal,
+         out: np.ndarray | None = None, initial_signal: float | None = None) -> dict[str, np.ndarray]:
+    """
+    macd line, its signal line (EMA of the line) and the histogram between them.
+    initial_signal continues the signal line from persisted state
+    """
+    n = len(ema_fast)
+    if out is None:
+        out = np.empty((3, n))
+    line, signal_line, histogram = out
+
+    np.subtract(ema_fast, ema_slow, out=line)
+    ema(line, signal, out=signal_line, initial=initial_signal)
+    np.subtract(line, signal_line, out=histogram)
+
+    return {'macd_line': line, 'signal_line': signal_line, 'histogram': histogram}
+
+
+def bollinger(values: np.ndarray, window: int = bollinger_window, width: float = bollinger_width,
+              out: np.ndarray | None = None) -> dict[str, np.ndarray]:
+    """
+    middle band (SMA), upper and lower bands at `width` standard deviations, band width and %B
+    """
+    n = len(values)
+    if out is None:
+        out = np.empty((5, n))
+    middle, upper, lower, band_width, percent_b = out
+
+    sma(values, window, out=middle)
+
+    # The deviation lands in band_width first, then becomes the actual band width
+    deviation = rolling_std(values, window, mean=middle, out=band_width)
+    deviation *= width
+    np.add(middle, deviation, out=upper)
+    np.subtract(middle, deviation, out=lower)
+    np.subtract(upper, lower, out=band_width)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.subtract(values, lower, out=percent_b)
+        percent_b /= band_width
+
+    return {
+        'middle_band': middle,
+        'upper_band': upper,
+        'lower_band': lower,
+        'bb_width': band_width,
+        'percent_b': percent_b
+    }
+
+
+def column_names(periods: list[int] = ema_periods, windows: list[int] = sma_windows) -> list[str]:
+    """
+    output columns of compute_all, in buffer order
+    """
+    return ([f'ema_{period}' for period in periods]
+            + [f'sma_{window}' for window in windows]
+            + [f'rsi_{rsi_period}']
+            + ['macd_line', 'signal_line', 'histogram']
+            + ['middle_band', 'upper_band', 'lower_band', 'bb_width', 'percent_b'])
+
+
+def compute_all(prices: np.ndarray, periods: list[int] = ema_periods,
+                windows: list[int] = sma_windows) -> dict[str, np.ndarray]:
+    """
+    every indicator column for a price series in one call. all outputs are rows of a single
+    preallocated (columns x rows) buffer and no intermediate frame is built.
+    sma columns follow the SQL window semantics (partial windows at the start)
+    """
+    prices = as_price_array(prices)
+    names = column_names(periods, windows)
+    buffer = np.empty((len(names), len(prices)))
+    columns = dict(zip(names, buffer))
+
+    for period in periods:
+        ema(prices, period, out=columns[f'ema_{period}'])
+
+    for window in windows:
+        sma(prices, window, min_periods=1, out=columns[f'sma_{window}'])
+
+    rsi(prices, rsi_period, out=columns[f'rsi_{rsi_period}'])
+
+    # MACD reuses the fast and slow EMAs when they are part of the requested periods
+    fast = columns.get(f'ema_{macd_fast}')
+    if fast is None:
+        fast = ema(prices, macd_fast)
+    slow = columns.get(f'ema_{macd_slow}')
+    if slow is None:
+        slow = ema(prices, macd_slow)
+    start = names.index('macd_line')
+    macd(fast, slow, macd_signal, out=buffer[start:start + 3])
+
+    start = names.index('middle_band')
+    bollinger(prices, bollinger_window, bollinger_width, out=buffer[start:start + 5])
+
+    return columns
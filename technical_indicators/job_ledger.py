@@ -0,0 +1,146 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+ledger_path = Path(os.getenv('ETL_LEDGER_PATH', Path(__file__).parent.parent / "job_ledger.jsonl"))
+
+# Amounts summed over every stage of a job
+counters = (
+    'bytes_scanned',    # total_bytes_processed of its queries
+    'bytes_billed',     # total_bytes_billed of its queries and MERGEs
+    'slot_ms',          # slot milliseconds of its queries and MERGEs
+    'queries',
+    'rows_loaded',      # rows written by its load jobs
+    'bytes_loaded',     # size of the files its load jobs uploaded
+    'load_jobs',
+    'http_requests',    # requests sent to the sources, cache hits excluded
+    'http_bytes',       # response bodies received from the sources
+    'http_cache_hits'
+)
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+
+# Record of the job the current stage belongs to, stages of one job run on different threads
+_current = contextvars.ContextVar('job_record', default=None)
+
+
+def new_record(job_name: str) -> dict:
+    return {'job': job_name, 'status': None, 'seconds': {}, **{name: 0 for name in counters},
+            'process_peak_rss_mb': None}
+
+
+def current() -> dict | None:
+    return _current.get()
+
+
+def process_peak_rss_mb() -> float | None:
+    """
+    peak resident memory of the whole process so far, from resource on unix and psutil elsewhere.
+    it only grows and jobs share the process, so it is not the memory of any one job
+    """
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        pass
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+
+    memory = psutil.Process().memory_info()
+    return getattr(memory, 'peak_wset', memory.rss) / 1024 / 1024
+
+
+@contextmanager
+def active(record: dict, stage: str):
+    """
+    attribute everything measured inside the block to record, timed as stage.
+    process_peak_rss_mb is the process peak when the job's last stage ended, an upper bound of
+    what the job needed: a job that ends after a large one reports that one's peak
+    """
+    token = _current.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        elapsed = time.perf_counter() - start
+        peak = process_peak_rss_mb()
+        with _lock:
+            record['seconds'][stage] = record['seconds'].get(stage, 0.0) + elapsed
+            if peak is not None:
+                record['process_peak_rss_mb'] = max(record['process_peak_rss_mb'] or 0.0, round(peak, 1))
+        _current.reset(token)
+
+
+def add(record: dict | None = None, **amounts) -> None:
+    """
+    add amounts (names from counters) to record, by default the record of the running stage
+    """
+    record = record if record is not None else _current.get()
+    if record is None:
+        return
+
+    with _lock:
+        for name, amount in amounts.items():
+            record[name] += amount or 0
+
+
+def add_query(query_job, record: dict | None = None) -> None:
+    """
+    add the statistics of a finished BigQuery query job
+    """
+    add(record, bytes_scanned=query_job.total_bytes_processed, bytes_billed=query_job.total_bytes_billed,
+        slot_ms=query_job.slot_millis, queries=1)
+
+
+def add_load(load_job, record: dict | None = None) -> None:
+    """
+    add the statistics of a finished BigQuery load job
+    """
+    add(record, rows_loaded=load_job.output_rows, bytes_loaded=load_job.input_file_bytes, load_jobs=1)
+
+
+def write(records: list[dict], run_id: str) -> Path:
+    """
+    append the records of a run to the ledger, one json line per job
+    """
+    ledger_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(ledger_path, 'a') as f:
+        for record in records:
+            f.write(json.dumps({'run_id': run_id, **record}) + "\n")
+
+    return ledger_path
+
+
+def summary(records: list[dict], top: int = 5) -> list[str]:
+    """
+    the jobs that took longest and those that were billed most, the first places to optimize
+    """
+    lines = []
+
+    by_time = sorted(records, key=lambda record: sum(record['seconds'].values()), reverse=True)
+    for record in by_time[:top]:
+        seconds = ", ".join(f"{stage} {value:.2f}s" for stage, value in record['seconds'].items())
+        lines.append(f"{record['job']}: {sum(record['seconds'].values()):.2f}s ({seconds})")
+
+    by_bytes = sorted(records, key=lambda record: record['bytes_billed'], reverse=True)
+    for record in by_bytes[:top]:
+        if record['bytes_billed']:
+            lines.append(f"{record['job']}: {record['bytes_billed'] / 1024 / 1024:.2f} MB billed, "
+                         f"{record['slot_ms']:,} slot ms, {record['queries']} queries, {record['load_jobs']} loads")
+
+    return lines
+
+
+def run_id() -> str:
+    return datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
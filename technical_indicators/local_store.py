@@ -0,0 +1,113 @@
+import logging
+import shutil
+import uuid
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from technical_indicators import tracing
+
+store_root = Path(__file__).parent / "local_data"
+
+# BigQuery column types of the schema() functions and their Arrow counterparts
+arrow_types = {
+    'DATE': pa.date32(),
+    'FLOAT64': pa.float64(),
+    'FLOAT': pa.float64(),
+    'INT64': pa.int64(),
+    'INTEGER': pa.int64(),
+    'STRING': pa.string(),
+    'BOOL': pa.bool_(),
+    'BOOLEAN': pa.bool_(),
+    'TIMESTAMP': pa.timestamp('us', tz='UTC')
+}
+
+logger = logging.getLogger(__name__)
+
+
+def table_path(table_name: str) -> Path:
+    return store_root / table_name
+
+
+def to_arrow(dataframe: pd.DataFrame, table_schema: list[dict]) -> pa.Table:
+    """
+    typed arrow table for the frame, columns declared in table_schema get their BigQuery type
+    """
+    types = {field['name']: arrow_types.get(field['type'].upper()) for field in table_schema}
+    columns = {}
+
+    for name in dataframe.columns:
+        values = dataframe[name]
+        arrow_type = types.get(name)
+        if arrow_type == pa.date32():
+            values = pd.to_datetime(values).dt.date
+        elif arrow_type == pa.string():
+            values = values.astype("string")
+        columns[name] = pa.array(values, type=arrow_type, from_pandas=True)
+
+    return pa.table(columns)
+
+
+def write(table_name: str, dataframe: pd.DataFrame, table_schema: list[dict], date_column: str) -> Path:
+    """
+    replace the stored table with dataframe, one parquet file per month of date_column.
+    the new files are written next to the old ones and swapped in with two renames, the old table is
+    only deleted once the new one is in place. readers see either table whole, for the instant
+    between the renames the table is missing
+    """
+    with tracing.span('serialize', table=table_name, rows=len(dataframe)):
+        table = to_arrow(dataframe, table_schema)
+        table = table.replace_schema_metadata({'date_column': date_column})
+        months = pd.to_datetime(dataframe[date_column]).dt.strftime('%Y-%m').to_numpy()
+
+        target = table_path(table_name)
+        staging = target.with_name(f".{table_name}-{uuid.uuid4().hex[:8]}")
+
+        for month in sorted(set(months)):
+            partition = staging / f"month={month}"
+            partition.mkdir(parents=True)
+            pq.write_table(table.filter(pa.array(months == month)), partition / "data.parquet")
+
+        staging.mkdir(parents=True, exist_ok=True)
+        retired = None
+        if target.exists():
+            retired = target.with_name(f".{table_name}-old-{uuid.uuid4().hex[:8]}")
+            target.rename(retired)
+        staging.rename(target)
+        if retired is not None:
+            shutil.rmtree(retired, ignore_errors=True)
+
+    logger.info(f"{len(dataframe)} rows of {table_name} written to {target}")
+
+    return target
+
+
+def read(table_name: str, columns: list[str] | None = None, since: str | None = None) -> pd.DataFrame:
+    """
+    stored table oldest first. since ('YYYY-MM-DD') skips the month partitions before it
+    """
+    path = table_path(table_name)
+    if not path.exists():
+        raise FileNotFoundError(f"{table_name} is not in the local store, run main.py locally first")
+
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    date_column = (dataset.schema.metadata or {}).get(b'date_column', b'').decode() or None
+
+    expression = None
+    if since is not None:
+        expression = ds.field('month') >= since[:7]
+
+    names = [name for name in dataset.schema.names if name != 'month']
+    table = dataset.to_table(columns=columns or names, filter=expression)
+    df = table.to_pandas(date_as_object=False)
+
+    if since is not None and date_column in df.columns:
+        df = df[pd.to_datetime(df[date_column]) >= pd.Timestamp(since)]
+
+    if date_column in df.columns:
+        df = df.sort_values(date_column, kind='stable')
+
+    return df.reset_index(drop=True)
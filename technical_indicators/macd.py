@@ -1,22 +1,23 @@
 import pandas as pd
-import pandas_gbq
-from google.cloud import bigquery
 import logging
-from pathlib import Path
-import os
+from technical_indicators import bitcoin_ema, bq_client, etl_state, indicator_engine, local_store, query_backend, table_snapshot, tracing
 
 
-current_dir = Path(__file__).parent
-local_folder = current_dir / "testing_area"
-local_folder_string = str(local_folder.resolve())
-
 destination_table = "btc_macd"
 
+depends_on = ["bitcoin_ema"]
+
 logger = logging.getLogger(__name__)
 
 
-def calculate_macd(credentials) -> tuple[pd.DataFrame, int]:
-    client = bigquery.Client(credentials=credentials, project=credentials.project_id)
+def fetch_emas(credentials, emas: pd.DataFrame | None = None) -> tuple[pd.DataFrame, int]:
+    """
+    ema rows, oldest first. emas is the btc_ema table published by this run,
+    when given the query is skipped
+    """
+    if emas is not None:
+        df = emas[['timestamp', 'ema_9', 'ema_12', 'ema_26']].sort_values('timestamp').reset_index(drop=True)
+        return df, 0
 
     query = """
       SELECT
@@ -27,23 +28,48 @@ def calculate_macd(credentials) -> tuple[pd.DataFrame, int]:
     FROM connection-123.signals.btc_ema
     ORDER BY timestamp 
     """
-    query_job = client.query(query)
-    results = query_job.result()
-    df = results.to_dataframe()
-
-    bytes_processed = query_job.total_bytes_processed
-    logger.info(f"Query processed {bytes_processed:,} bytes ({bytes_processed / 1024 / 1024:.2f} MB)")
-    # Calculate MACD line
-    df['macd_line'] = df['ema_12'] - df['ema_26']
-    # Calculate signal line (9-period EMA of MACD line)
-    df['signal_line'] = df['macd_line'].ewm(span=9, adjust=False).mean()
-    # Calculate histogram
-    df['histogram'] = df['macd_line'] - df['signal_line']
-    # Return only the MACD components
-    macd_result = df[['timestamp', 'macd_line', 'signal_line', 'histogram']].copy()
+
+    return query_backend.run_query(credentials, query)
+
+def calculate_macd(credentials, emas: pd.DataFrame | None = None) -> tuple[pd.DataFrame, int]:
+    """
+    emas is the btc_ema table published by this run, when given the query is skipped
+    """
+    df, bytes_processed = fetch_emas(credentials, emas)
+    macd_result, _ = compute_macd(df)
 
     return macd_result, bytes_processed
 
+@tracing.traced('transform')
+def compute_macd(df: pd.DataFrame, previous: dict | None = None) -> tuple[pd.DataFrame, dict | None]:
+    """
+    macd components for the ema rows in df, the signal line continues from the persisted value
+    in previous when given. also returns the state at the last final row
+    """
+    # MACD line, signal line (9-period EMA of MACD line) and histogram
+    components = indicator_engine.macd(
+        indicator_engine.as_price_array(df['ema_12']),
+        indicator_engine.as_price_array(df['ema_26']),
+        signal=9,
+        initial_signal=previous['signal_line'] if previous else None
+    )
+
+    # Return only the MACD components
+    macd_result = df[['timestamp']].copy()
+    for column, values in components.items():
+        macd_result[column] = values
+
+    index = etl_state.checkpoint_index(len(df))
+    if index is None:
+        return macd_result, None
+
+    state = {
+        'last_date': pd.Timestamp(df['timestamp'].iloc[index]).date().isoformat(),
+        'signal_line': float(components['signal_line'][index])
+    }
+
+    return macd_result, state
+
 def schema() -> list[dict]:
     """
     create the schema for the bq table
@@ -57,33 +83,50 @@ def schema() -> list[dict]:
     return table_schema
 
 
-def run_etl(credentials, dataset: str, mode: str) -> int:
+def extract(credentials, dataset: str, mode: str) -> dict:
+    """
+    ema rows after the persisted checkpoint on incremental runs, otherwise the whole btc_ema table
+    """
+    if mode == 'prod' and etl_state.incremental_enabled():
+        return etl_state.extract_incremental(credentials, dataset, destination_table, bitcoin_ema.emas_after)
+
+    df, bytes_processed = fetch_emas(credentials, emas=table_snapshot.get("btc_ema"))
+    return {'rows': df, 'bytes_processed': bytes_processed}
+
+def transform(payload: dict) -> dict:
+    if payload.get('incremental'):
+        return etl_state.transform_incremental(payload, compute_macd)
+
+    table, _ = compute_macd(payload['rows'])
+    return {'table': table, 'bytes_processed': payload['bytes_processed']}
+
+def load(credentials, dataset: str, mode: str, payload: dict) -> int:
+
+    if payload.get('incremental'):
+        return etl_state.load_incremental(credentials, dataset, destination_table, schema(), payload)
+
+    table, bytes_processed = payload['table'], payload['bytes_processed']
 
     if mode == 'prod':
 
-        table,bytes_processed = calculate_macd(credentials)
         table_schema = schema()
         target_table = dataset + destination_table
 
-        pandas_gbq.to_gbq(
+        bq_client.merge_rows(
             dataframe=table,
             destination_table=target_table,
-            project_id="connection-123",
             table_schema=table_schema,
             credentials=credentials,
-            if_exists="replace"
+            key_columns=['timestamp']
         )
 
         return bytes_processed
 
     else:
         print('test mode')
-        table, bytes_processed = calculate_macd(credentials)
-        # Create subdirectory if it doesn't exist
-        subdir = local_folder / calculate_macd.__name__
-        subdir.mkdir(parents=True, exist_ok=True)
-
-        csv_filename = os.path.join(str(subdir), "data.csv")
-        table.to_csv(csv_filename, index=False)
-        print(f'Data saved to {csv_filename}')
+        path = local_store.write(destination_table, table, schema(), 'timestamp')
+        print(f'Data saved to {path}')
         return bytes_processed
+
+def run_etl(credentials, dataset: str, mode: str) -> int:
+    return load(credentials, dataset, mode, transform(extract(credentials, dataset, mode)))
@@ -0,0 +1,322 @@
+"""
+run history in SQLite, one row per job and run, for questions like "has bitcoin_ema got slower this month?"
+
+    python -m technical_indicators.metrics_store backfill          # import logfile.txt and job_ledger.jsonl
+    python -m technical_indicators.metrics_store check             # latest run against the rolling baseline
+    python -m technical_indicators.metrics_store history bitcoin_ema --days 30
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import statistics
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from technical_indicators import job_ledger
+
+db_path = Path(os.getenv('ETL_METRICS_DB', Path(__file__).parent.parent / "run_metrics.sqlite"))
+logfile_path = Path(__file__).parent.parent / "logfile.txt"
+
+# Successful runs of a job before the latest one that make up its baseline
+baseline_runs = 30
+min_baseline_runs = 5
+
+# A job is flagged when its robust z-score exceeds this and it is also this much slower than its median
+z_threshold = 3.5
+min_slowdown = 0.2
+
+logger = logging.getLogger(__name__)
+
+ddl = """
+CREATE TABLE IF NOT EXISTS job_runs (
+    run_id TEXT NOT NULL,
+    job TEXT NOT NULL,
+    started TEXT NOT NULL,          -- local time the run started, as in logfile.txt
+    source TEXT NOT NULL,           -- 'run', 'ledger' or 'logfile'
+    status TEXT,
+    seconds REAL,
+    bytes_processed INTEGER,
+    bytes_billed INTEGER,
+    rows_loaded INTEGER,
+    process_peak_rss_mb REAL,       -- peak of the whole process when the job ended, not per job
+    PRIMARY KEY (run_id, job)
+);
+CREATE INDEX IF NOT EXISTS job_runs_job_started ON job_runs (job, started);
+CREATE INDEX IF NOT EXISTS job_runs_started ON job_runs (started);
+"""
+
+columns = ('run_id', 'job', 'started', 'source', 'status', 'seconds', 'bytes_processed', 'bytes_billed',
+           'rows_loaded', 'process_peak_rss_mb')
+
+
+def connect(path: Path = None) -> sqlite3.Connection:
+    path = path or db_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(path)
+    con.row_factory = sqlite3.Row
+    con.executescript(ddl)
+
+    # Stores created before the column was renamed
+    names = {row['name'] for row in con.execute("PRAGMA table_info(job_runs)")}
+    if 'peak_rss_mb' in names:
+        con.execute("ALTER TABLE job_runs RENAME COLUMN peak_rss_mb TO process_peak_rss_mb")
+        con.commit()
+    return con
+
+
+def insert(con: sqlite3.Connection, rows: list[dict]) -> int:
+    """
+    store job rows, the ones of a run and job already stored are kept. returns the rows added
+    """
+    before = con.total_changes
+    con.executemany(
+        f"INSERT OR IGNORE INTO job_runs ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+        [tuple(row.get(name) for name in columns) for row in rows]
+    )
+    con.commit()
+    return con.total_changes - before
+
+
+def ledger_rows(records: list[dict], run_id: str, started: datetime, source: str) -> list[dict]:
+    """
+    job rows from the job ledger records of a run
+    """
+    return [{
+        'run_id': run_id,
+        'job': record['job'],
+        'started': started.isoformat(timespec='seconds'),
+        'source': source,
+        'status': record['status'],
+        'seconds': round(sum(record['seconds'].values()), 3) if record['seconds'] else None,
+        'bytes_processed': record.get('bytes_scanned'),
+        'bytes_billed': record.get('bytes_billed'),
+        'rows_loaded': record.get('rows_loaded'),
+        # Ledger lines written before the rename hold the same value as peak_rss_mb
+        'process_peak_rss_mb': record.get('process_peak_rss_mb', record.get('peak_rss_mb'))
+    } for record in records]
+
+
+def record_run(records: list[dict], run_id: str, started: datetime) -> int:
+    """
+    store the job records of the run that just finished
+    """
+    con = connect()
+    try:
+        return insert(con, ledger_rows(records, run_id, started, 'run'))
+    finally:
+        con.close()
+
+
+def run_started(run_id: str) -> datetime:
+    """
+    local start time of a run from its id, ledger run ids are UTC
+    """
+    utc = datetime.strptime(run_id, '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+    return utc.astimezone().replace(tzinfo=None)
+
+
+def read_ledger(path: Path) -> list[dict]:
+    """
+    job rows of every run in the job ledger
+    """
+    runs = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                runs.setdefault(record.pop('run_id'), []).append(record)
+
+    rows = []
+    for run_id, records in runs.items():
+        rows.extend(ledger_rows(records, run_id, run_started(run_id), 'ledger'))
+    return rows
+
+
+log_line = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),\d+ - ([\w.]+) - \w+ - (.*)$")
+completed = re.compile(r"Completed (?:\w+\.)?(\w+) in ([\d.]+) seconds")
+starting = re.compile(r"Starting ETL job: (?:\w+\.)?(\w+)")
+query_bytes = re.compile(r"Query processed ([\d,]+) bytes")
+rows_loaded = re.compile(r"(\d+) out of \d+ rows (?:loaded|inserted or updated)")
+not_completed = re.compile(r"Jobs not completed: \[(.*)\]")
+
+# Modules that log for every job, their lines cannot be attributed to one
+shared_modules = ('query_backend', 'bq_client', 'http_client', 'local_store')
+
+
+def parse_logfile(path: Path) -> list[dict]:
+    """
+    job rows of the runs logged in logfile.txt, a run ends with its 'Total execution time' line.
+    bytes come from the 'Query processed' lines of the job's module, rows from the load lines that
+    follow its 'Starting ETL job' line, which holds for the runs before jobs ran in parallel
+    """
+    rows, jobs, run_start, current = [], {}, None, None
+
+    def job(name: str) -> dict:
+        return jobs.setdefault(name.lower(), {'job': name.lower(), 'status': None, 'seconds': None,
+                                              'bytes_processed': None, 'rows_loaded': None})
+
+    # pandas_gbq starts its 'rows loaded' messages with \r, universal newlines would split them from their
+    # timestamp. lines only end at \n, the \r inside a record is dropped
+    with open(path, errors='replace', newline='\n') as f:
+        for line in f:
+            match = log_line.match(line.replace('\r', '').strip())
+            if match is None:
+                continue
+            timestamp, logger_name, message = match.groups()
+
+            # The predictor logs after the run, a run starts with its first job
+            if (found := starting.search(message)) is not None:
+                if run_start is None:
+                    run_start = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
+                current = job(found.group(1))
+            elif (found := completed.search(message)) is not None:
+                entry = job(found.group(1))
+                entry.update(status='success', seconds=float(found.group(2)))
+            elif (found := query_bytes.search(message)) is not None and logger_name.startswith('technical_indicators.') \
+                    and logger_name.rsplit('.', 1)[-1] not in shared_modules:
+                entry = job(logger_name.rsplit('.', 1)[-1])
+                entry['bytes_processed'] = (entry['bytes_processed'] or 0) + int(found.group(1).replace(',', ''))
+            elif (found := rows_loaded.search(message)) is not None and current is not None:
+                current['rows_loaded'] = (current['rows_loaded'] or 0) + int(found.group(1))
+            elif (found := not_completed.search(message)) is not None:
+                for name in re.findall(r"'(\w+)'", found.group(1)):
+                    job(name)['status'] = job(name)['status'] or 'failed'
+            elif message.startswith('Total execution time') and run_start is not None:
+                run_id = run_start.strftime('log-%Y%m%dT%H%M%S')
+                run_end = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
+                for entry in jobs.values():
+                    rows.append({**entry, 'run_id': run_id, 'started': run_start.isoformat(timespec='seconds'),
+                                 'finished': run_end, 'source': 'logfile'})
+                jobs, run_start, current = {}, None, None
+
+    return rows
+
+
+def backfill(logfile: Path = logfile_path, ledger: Path = job_ledger.ledger_path) -> int:
+    """
+    import the job ledger, then the logged runs it does not cover. returns the rows added
+    """
+    con = connect()
+    try:
+        added = insert(con, read_ledger(ledger)) if ledger.exists() else 0
+
+        if logfile.exists():
+            logged = parse_logfile(logfile)
+            # Runs since the ledger exists are logged too, they are imported once
+            known = [datetime.fromisoformat(row['started']) for row in
+                     con.execute("SELECT DISTINCT started FROM job_runs WHERE source != 'logfile'")]
+            fresh = [row for row in logged if not any(
+                datetime.fromisoformat(row['started']) - timedelta(minutes=1) <= started <= row['finished']
+                for started in known)]
+            added += insert(con, fresh)
+    finally:
+        con.close()
+
+    logger.info(f"{added} job runs added to {db_path}")
+    return added
+
+
+def latest_run(con: sqlite3.Connection) -> str | None:
+    row = con.execute("SELECT run_id FROM job_runs ORDER BY started DESC LIMIT 1").fetchone()
+    return row['run_id'] if row else None
+
+
+def robust_z(value: float, baseline: list[float]) -> float | None:
+    """
+    distance of value from the baseline median in median absolute deviations, scaled to match a
+    standard z-score for normal data. one slow outlier in the baseline barely moves it
+    """
+    median = statistics.median(baseline)
+    mad = statistics.median(abs(x - median) for x in baseline)
+    if mad == 0:
+        mad = statistics.mean(abs(x - median) for x in baseline) * 0.7979
+    if mad == 0:
+        return None
+    return 0.6745 * (value - median) / mad
+
+
+def check(run_id: str | None = None, window: int = baseline_runs, threshold: float = z_threshold) -> list[dict]:
+    """
+    jobs of run_id (default the latest run) significantly slower than their previous successful runs
+    """
+    con = connect()
+    try:
+        run_id = run_id or latest_run(con)
+        if run_id is None:
+            return []
+
+        flagged = []
+        latest = con.execute("SELECT * FROM job_runs WHERE run_id = ? AND status = 'success' "
+                             "AND seconds IS NOT NULL", (run_id,)).fetchall()
+        for row in latest:
+            baseline = [previous['seconds'] for previous in con.execute(
+                "SELECT seconds FROM job_runs WHERE job = ? AND started < ? AND status = 'success' "
+                "AND seconds IS NOT NULL ORDER BY started DESC LIMIT ?", (row['job'], row['started'], window))]
+            if len(baseline) < min_baseline_runs:
+                continue
+
+            median = statistics.median(baseline)
+            z = robust_z(row['seconds'], baseline)
+            if z is not None and z > threshold and row['seconds'] > median * (1 + min_slowdown):
+                flagged.append({'job': row['job'], 'seconds': row['seconds'], 'median': median,
+                                'z': round(z, 1), 'runs': len(baseline)})
+    finally:
+        con.close()
+
+    return flagged
+
+
+def history(job: str, days: int = 30) -> list[sqlite3.Row]:
+    since = (datetime.now() - timedelta(days=days)).isoformat(timespec='seconds')
+    con = connect()
+    try:
+        return con.execute("SELECT started, status, seconds, bytes_processed, rows_loaded FROM job_runs "
+                           "WHERE job = ? AND started >= ? ORDER BY started", (job, since)).fetchall()
+    finally:
+        con.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="run metrics store")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('backfill', help="import logfile.txt and job_ledger.jsonl")
+
+    check_parser = commands.add_parser('check', help="flag jobs of the latest run slower than their baseline")
+    check_parser.add_argument('--run-id', help="run to check instead of the latest one")
+    check_parser.add_argument('--window', type=int, default=baseline_runs, help="previous runs in the baseline")
+    check_parser.add_argument('--threshold', type=float, default=z_threshold, help="robust z-score to flag")
+
+    history_parser = commands.add_parser('history', help="runs of one job")
+    history_parser.add_argument('job', help="job name, e.g. bitcoin_ema")
+    history_parser.add_argument('--days', type=int, default=30)
+
+    args = parser.parse_args()
+
+    if args.command == 'backfill':
+        backfill()
+        return 0
+
+    if args.command == 'history':
+        for row in history(args.job, args.days):
+            seconds = f"{row['seconds']:.2f}s" if row['seconds'] is not None else "-"
+            print(f"{row['started']}  {row['status'] or '-':8} {seconds:>9}  "
+                  f"{row['bytes_processed'] or 0:>12,} bytes  {row['rows_loaded'] or 0:>7,} rows")
+        return 0
+
+    flagged = check(args.run_id, args.window, args.threshold)
+    for job in flagged:
+        logger.error(f"SLOWDOWN {job['job']}: {job['seconds']:.2f}s against a median of {job['median']:.2f}s "
+                     f"over {job['runs']} runs (robust z {job['z']})")
+    if not flagged:
+        logger.info("No significant slowdown in the latest run")
+    return 1 if flagged else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
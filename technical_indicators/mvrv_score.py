@@ -1,30 +1,30 @@
 import pandas as pd
-import requests
-from google.cloud import bigquery
-import os
 import logging
-from datetime import datetime
-from pathlib import Path
+from datetime import date, datetime
+from technical_indicators import http_client, local_store, tracing, watermark
 
-current_dir = Path(__file__).parent
-local_folder = current_dir / "testing_area"
-local_folder_string = str(local_folder.resolve())
 
 destination_table = "mvrv_score"
 
+depends_on = []
+
 logger = logging.getLogger(__name__)
 
-def fetch_mvrv() -> pd.DataFrame:
+@tracing.traced('fetch')
+def fetch_mvrv(start: date | None = None) -> pd.DataFrame:
+    """
+    daily mvrv since 2020, or only from start onwards when the table is already loaded
+    """
     url = "https://community-api.coinmetrics.io/v4/timeseries/asset-metrics"
 
     params = {
         'assets': 'btc',
         'metrics': 'CapMVRVCur',
-        'start_time': '2020-01-01',
+        'start_time': start.isoformat() if start else '2020-01-01',
         'end_time': datetime.now().strftime('%Y-%m-%d'),
         'frequency': '1d'
     }
-    response = requests.get(url, params=params)
+    response = http_client.get(url, params=params)
     response.raise_for_status()
     data = response.json()
 
@@ -53,45 +53,36 @@ def schema() -> list[dict]:
 
     return table_schema
 
-def run_etl(credentials,dataset:str,mode:str) -> int:
-
+def extract(credentials, dataset: str, mode: str) -> dict:
+    """
+    on incremental prod runs only the range past the watermark is fetched
+    """
+    start = None
     if mode == 'prod':
+        start = watermark.fetch_start(watermark.load(credentials, dataset, destination_table))
 
-        project = "connection-123"
-        client = bigquery.Client(credentials=credentials, project=project)
-        table = fetch_mvrv()
-        table_schema = schema()
+    return {'table': fetch_mvrv(start), 'start': start, 'bytes_processed': 0}
 
-        job_config = bigquery.LoadJobConfig(
-            schema=table_schema,
-            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-            time_partitioning=bigquery.TimePartitioning(
-                type_=bigquery.TimePartitioningType.DAY,
-                field="time"
-            ),
-            destination_table_description="Daily value for the mvrv score"
-        )
+def load(credentials, dataset: str, mode: str, payload: dict) -> int:
+    table = payload['table']
 
-        table_ref = dataset + destination_table
+    if mode == 'prod':
 
-        job = client.load_table_from_dataframe(
-            table,
-            table_ref,
-            job_config=job_config
-        )
+        table_schema = schema()
 
-        job.result()
+        watermark.write(
+            credentials, dataset, destination_table, table, table_schema, 'time',
+            partition_field="time",
+            description="Daily value for the mvrv score"
+        )
 
         return 0
 
     else:
         print('test mode')
-        table = fetch_mvrv()
-        # Create subdirectory if it doesn't exist
-        subdir = local_folder / fetch_mvrv.__name__
-        subdir.mkdir(parents=True, exist_ok=True)
-
-        csv_filename = os.path.join(str(subdir), "data.csv")
-        table.to_csv(csv_filename, index=False)
-        print(f'Data saved to {csv_filename}')
+        path = local_store.write(destination_table, table, schema(), 'time')
+        print(f'Data saved to {path}')
         return 0
+
+def run_etl(credentials, dataset: str, mode: str) -> int:
+    return load(credentials, dataset, mode, extract(credentials, dataset, mode))
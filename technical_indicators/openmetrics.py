@@ -0,0 +1,202 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+textfile_path = Path(os.getenv('METRICS_TEXTFILE', Path(__file__).parent.parent / "metrics.prom"))
+
+content_type = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Upper bounds in seconds, network calls and queries take milliseconds to seconds, stages up to minutes
+request_buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+stage_buckets = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Every metric the pipeline and the dashboard record, series are created per label set on first use
+metrics = {
+    'etl_stage_duration_seconds': {'type': 'histogram', 'buckets': stage_buckets,
+                                   'help': "Wall time of one ETL stage of a job"},
+    'etl_job_runs': {'type': 'counter', 'help': "Jobs finished, by final status"},
+    'etl_run_duration_seconds': {'type': 'gauge', 'help': "Wall time of the last pipeline run"},
+    'etl_queue_depth': {'type': 'gauge', 'help': "Jobs waiting for a stage worker"},
+    'etl_queue_depth_max': {'type': 'gauge', 'help': "Most jobs waiting for a stage worker during the run"},
+    'etl_active_stages': {'type': 'gauge', 'help': "Stages running on the worker pool"},
+    'http_request_duration_seconds': {'type': 'histogram', 'buckets': request_buckets,
+                                      'help': "Time to the full response of a source, retries included"},
+    'http_cache_requests': {'type': 'counter', 'help': "Source requests by http cache result (hit, revalidated, miss)"},
+    'query_duration_seconds': {'type': 'histogram', 'buckets': request_buckets,
+                               'help': "Time to the result of a query, cached ones included"},
+    'query_cache_requests': {'type': 'counter', 'help': "Queries by query cache result (hit, miss, off)"},
+    'dashboard_load_seconds': {'type': 'histogram', 'buckets': request_buckets,
+                               'help': "Time a dashboard page spends loading its table"},
+    'dashboard_render_seconds': {'type': 'histogram', 'buckets': request_buckets,
+                                 'help': "Time a dashboard page script takes from start to end"},
+}
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+# name -> label items -> value, or [count per bucket and +Inf, sum] for histograms
+_series = {name: {} for name in metrics}
+_server = None
+
+
+def labels_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def inc(name: str, amount: float = 1, **labels) -> None:
+    key = labels_key(labels)
+    with _lock:
+        series = _series[name]
+        series[key] = series.get(key, 0) + amount
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    key = labels_key(labels)
+    with _lock:
+        _series[name][key] = value
+
+
+def max_gauge(name: str, value: float, **labels) -> None:
+    """
+    keep the highest value set during the process
+    """
+    key = labels_key(labels)
+    with _lock:
+        series = _series[name]
+        series[key] = max(series.get(key, value), value)
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """
+    count value in its histogram bucket. only the bucket counts and the sum are kept
+    """
+    buckets = metrics[name]['buckets']
+    index = bisect_left(buckets, value)
+    key = labels_key(labels)
+    with _lock:
+        series = _series[name].get(key)
+        if series is None:
+            series = _series[name][key] = [[0] * (len(buckets) + 1), 0.0]
+        series[0][index] += 1
+        series[1] += value
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """
+    observe the seconds the block took
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def label_text(items, extra: tuple = ()) -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in (*items, *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render() -> str:
+    """
+    every recorded series in the OpenMetrics text format
+    """
+    with _lock:
+        snapshot = {name: {key: ([*value[0]], value[1]) if isinstance(value, list) else value
+                           for key, value in series.items()}
+                    for name, series in _series.items()}
+
+    lines = []
+    for name, series in snapshot.items():
+        if not series:
+            continue
+        metric = metrics[name]
+        lines.append(f"# TYPE {name} {metric['type']}")
+        lines.append(f"# HELP {name} {metric['help']}")
+
+        for key, value in sorted(series.items()):
+            if metric['type'] == 'counter':
+                lines.append(f"{name}_total{label_text(key)} {number(value)}")
+            elif metric['type'] == 'gauge':
+                lines.append(f"{name}{label_text(key)} {number(value)}")
+            else:
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip((*metric['buckets'], '+Inf'), counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{label_text(key, (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_count{label_text(key)} {cumulative}")
+                lines.append(f"{name}_sum{label_text(key)} {number(total)}")
+
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: Path | None = None) -> Path:
+    """
+    write the exposition for a textfile collector, swapped in whole so it is never read half written
+    """
+    path = path or textfile_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    staging = path.with_name(f".{path.name}.{os.getpid()}")
+    staging.write_text(render())
+    os.replace(staging, path)
+    return path
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    serve /metrics from a daemon thread, once per process
+    """
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
+            logger.info(f"Metrics served on http://{host}:{port}/metrics")
+    return _server
+
+
+def serve_from_env() -> ThreadingHTTPServer | None:
+    """
+    serve when METRICS_PORT is set, for long running processes like the dashboard
+    """
+    port = os.getenv('METRICS_PORT')
+    if not port:
+        return None
+    try:
+        return serve(int(port), os.getenv('METRICS_HOST', '127.0.0.1'))
+    except OSError as e:
+        logger.warning(f"Metrics endpoint not started on port {port}: {e}")
+        return None
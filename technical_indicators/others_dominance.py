@@ -1,22 +1,15 @@
 import pandas as pd
-import pandas_gbq
-from google.cloud import bigquery
 import logging
-from pathlib import Path
-import os
-
-current_dir = Path(__file__).parent
-local_folder = current_dir / "testing_area"
-local_folder_string = str(local_folder.resolve())
+from technical_indicators import bq_client, local_store, query_backend
 
 
 destination_table = "others_dominance"
 
+depends_on = ["cmc_data"]
+
 logger = logging.getLogger(__name__)
 
 def fetch_data(credentials) -> tuple[pd.DataFrame, int]:
-    client = bigquery.Client(credentials=credentials, project=credentials.project_id)
-
     query = """
         SELECT
         status_timestamp,
@@ -24,15 +17,10 @@ def fetch_data(credentials) -> tuple[pd.DataFrame, int]:
         data_btc_dominance
         FROM connection-123.signals.cmc_data
     """
-    query_job = client.query(query)
-    results = query_job.result()
-    dominance_data = results.to_dataframe()
+    dominance_data, bytes_processed = query_backend.run_query(credentials, query)
 
     dominance_data['others_dominance'] = 100 - (dominance_data['data_eth_dominance'] + dominance_data['data_btc_dominance'])
 
-    bytes_processed = query_job.total_bytes_processed
-    logger.info(f"Query processed {bytes_processed:,} bytes ({bytes_processed / 1024 / 1024:.2f} MB)")
-
     return dominance_data, bytes_processed
 
 def schema() -> list[dict]:
@@ -47,34 +35,33 @@ def schema() -> list[dict]:
     ]
     return table_schema
 
-def run_etl(credentials, dataset: str, mode: str) -> int:
+def extract(credentials, dataset: str, mode: str) -> dict:
+    table, bytes_processed = fetch_data(credentials)
+    return {'table': table, 'bytes_processed': bytes_processed}
+
+def load(credentials, dataset: str, mode: str, payload: dict) -> int:
+    table, bytes_processed = payload['table'], payload['bytes_processed']
 
     if mode == 'prod':
 
-        table, bytes_processed = fetch_data(credentials)
         table_schema = schema()
         target_table = dataset + destination_table
 
-        pandas_gbq.to_gbq(
+        bq_client.merge_rows(
             dataframe=table,
             destination_table=target_table,
-            project_id="connection-123",
             table_schema=table_schema,
             credentials=credentials,
-            if_exists="replace"
+            key_columns=['status_timestamp']
         )
 
         return bytes_processed
 
     else:
         print('test mode')
-        table, bytes_processed = fetch_data(credentials)
-        # Create subdirectory if it doesn't exist
-        subdir = local_folder / fetch_data.__name__
-        subdir.mkdir(parents=True, exist_ok=True)
-
-        csv_filename = os.path.join(str(subdir), "data.csv")
-        table.to_csv(csv_filename, index=False)
-        print(f'Data saved to {csv_filename}')
+        path = local_store.write(destination_table, table, schema(), 'status_timestamp')
+        print(f'Data saved to {path}')
         return bytes_processed
 
+def run_etl(credentials, dataset: str, mode: str) -> int:
+    return load(credentials, dataset, mode, extract(credentials, dataset, mode))
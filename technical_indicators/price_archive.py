@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import threading
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from technical_indicators import tracing
+
+archive_dir = Path(os.getenv('PRICE_ARCHIVE_DIR', Path(__file__).parent.parent / ".price_archive"))
+
+# Tickers the full history of an asset is backfilled from when it is not archived yet
+tickers = {
+    'bitcoin': 'BTC-USD'
+}
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+
+
+def data_path(asset: str) -> Path:
+    return archive_dir / f"{asset}.f8"
+
+
+def meta_path(asset: str) -> Path:
+    return archive_dir / f"{asset}.json"
+
+
+def first_date(asset: str) -> date | None:
+    """
+    date of the first archived price, None when the asset is not archived
+    """
+    try:
+        return date.fromisoformat(json.loads(meta_path(asset).read_text())['start'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def prices(asset: str) -> tuple[np.ndarray, date | None]:
+    """
+    read-only memory map of the daily closes, one float64 per day from the first date on (NaN
+    for days without a price), and that first date. slices of it are views, nothing is copied
+    """
+    start = first_date(asset)
+    if start is None or not data_path(asset).exists() or data_path(asset).stat().st_size == 0:
+        return np.empty(0), None
+
+    return np.memmap(data_path(asset), dtype=np.float64, mode='r'), start
+
+
+def update(asset: str, dates, values) -> None:
+    """
+    write daily closes into the archive. new days are appended, days already archived are
+    overwritten (the latest closes get revised), a date before the first one rewrites the file
+    """
+    dates = pd.to_datetime(pd.Series(dates)).dt.date.to_numpy()
+    values = np.asarray(values, dtype=np.float64)
+    if len(dates) == 0:
+        return
+
+    with _lock:
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        start = first_date(asset)
+        path = data_path(asset)
+
+        if start is None or min(dates) < start:
+            # Nothing archived yet or older history arrived, the file is rebuilt from the earliest date
+            existing, old_start = prices(asset)
+            new_start = min(dates) if start is None else min(min(dates), start)
+            rebuilt = np.full(0 if start is None else (old_start - new_start).days + len(existing), np.nan)
+            if start is not None:
+                rebuilt[(old_start - new_start).days:] = existing
+            del existing
+            rebuilt.tofile(path)
+            meta_path(asset).write_text(json.dumps({'start': new_start.isoformat()}))
+            start = new_start
+
+        offsets = np.array([(day - start).days for day in dates])
+        length = path.stat().st_size // 8
+        needed = int(offsets.max()) + 1
+
+        if needed > length:
+            with open(path, 'ab') as f:
+                np.full(needed - length, np.nan).tofile(f)
+
+        archive = np.memmap(path, dtype=np.float64, mode='r+')
+        archive[offsets] = values
+        archive.flush()
+        del archive
+
+    logger.info(f"archived {len(dates)} {asset} closes up to {max(dates)}")
+
+
+def backfill(asset: str) -> None:
+    """
+    archive the full daily history of the asset from inception, once
+    """
+    if first_date(asset) is not None:
+        return
+
+    with tracing.span('fetch', ticker=tickers[asset]):
+        history = yf.download(tickers[asset], period='max', auto_adjust=False, progress=False)
+    closes = history['Close'].squeeze().dropna()
+    update(asset, closes.index, closes.to_numpy())
+
+
+def series(asset: str, since: date | None = None, until: date | None = None) -> pd.Series:
+    """
+    archived closes between since and until (inclusive) indexed by date, missing days dropped
+    """
+    values, start = prices(asset)
+    if start is None:
+        return pd.Series(dtype=np.float64)
+
+    first = 0 if since is None else max(0, (since - start).days)
+    last = len(values) if until is None else min(len(values), (until - start).days + 1)
+
+    index = pd.date_range(start + timedelta(days=first), periods=max(0, last - first), freq='D')
+    closes = pd.Series(values[first:last], index=index, copy=False)
+
+    return closes.dropna()
+
+
+def before(asset: str, day: date, days: int) -> np.ndarray:
+    """
+    up to `days` archived closes strictly before day, oldest first, to warm up long windows.
+    a view into the memory map when no day is missing
+    """
+    values, start = prices(asset)
+    if start is None:
+        return np.empty(0)
+
+    end = max(0, min(len(values), (day - start).days))
+    window = values[max(0, end - days):end]
+
+    if np.isnan(window).any():
+        window = window[~np.isnan(window)]
+
+    return window
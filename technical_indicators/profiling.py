@@ -0,0 +1,133 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+profile_root = Path(os.getenv('ETL_PROFILE_DIR', Path(__file__).parent.parent / "profiles"))
+
+# Allocation sites per stage and hottest functions listed in the reports
+top_n = int(os.getenv('ETL_PROFILE_TOP', '25'))
+
+# Frames kept per allocation, enough to see which job code called into pandas
+traceback_frames = 10
+
+logger = logging.getLogger(__name__)
+
+# One profiled stage at a time: since python 3.12 cProfile sees every thread, and tracemalloc always did
+_serial = threading.Lock()
+_profiles = {}
+_allocations = {}
+_run_dir = None
+
+
+def selected_jobs() -> set[str] | None:
+    """
+    jobs named in ETL_PROFILE (comma separated job keys, or 'all'), None when profiling is off
+    """
+    value = os.getenv('ETL_PROFILE', '').strip()
+    if not value or value == '0':
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def enabled() -> bool:
+    return selected_jobs() is not None
+
+
+def wanted(job_name: str) -> bool:
+    jobs = selected_jobs()
+    return jobs is not None and ('all' in jobs or '1' in jobs or job_name in jobs)
+
+
+def start_run(run_id: str) -> Path:
+    """
+    profiles of this run go to profile_root/run_id
+    """
+    global _run_dir
+    _run_dir = profile_root / run_id
+    _profiles.clear()
+    _allocations.clear()
+    return _run_dir
+
+
+@contextmanager
+def stage(job_name: str, stage_name: str):
+    """
+    run the block alone and, for a selected job, under cProfile and tracemalloc.
+    the stages of a job add up in one profile
+    """
+    with _serial:
+        if not wanted(job_name):
+            yield
+            return
+
+        profile = _profiles.setdefault(job_name, cProfile.Profile())
+        tracemalloc.start(traceback_frames)
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            _allocations.setdefault(job_name, []).append((stage_name, peak, snapshot))
+
+
+def allocation_report(job_name: str) -> str:
+    """
+    per stage, the peak traced memory and the allocation sites holding most memory when it ended
+    """
+    lines = [f"{job_name}: top {top_n} allocation sites still held at the end of each stage"]
+    for stage_name, peak, snapshot in _allocations.get(job_name, []):
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>")
+        ])
+        statistics = snapshot.statistics('lineno')
+        total = sum(stat.size for stat in statistics)
+        lines.append("")
+        lines.append(f"[{stage_name}] peak {peak / 1024 / 1024:.2f} MB, held {total / 1024 / 1024:.2f} MB")
+        for stat in statistics[:top_n]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size / 1024:12.1f} KiB {stat.count:9} blocks  {frame.filename}:{frame.lineno}")
+    return "\n".join(lines) + "\n"
+
+
+def hottest(paths: list[Path], sort: str = 'tottime') -> str:
+    """
+    the top_n functions over all profiles by own time
+    """
+    stream = io.StringIO()
+    stats = pstats.Stats(*[str(path) for path in paths], stream=stream)
+    stats.sort_stats(sort).print_stats(top_n)
+    return stream.getvalue()
+
+
+def finish() -> Path | None:
+    """
+    write <job>.pstats and <job>.alloc.txt per profiled job and summary.txt over all of them
+    """
+    if _run_dir is None or not _profiles:
+        return None
+
+    _run_dir.mkdir(parents=True, exist_ok=True)
+
+    paths = []
+    for job_name, profile in _profiles.items():
+        path = _run_dir / f"{job_name}.pstats"
+        profile.dump_stats(path)
+        paths.append(path)
+        (_run_dir / f"{job_name}.alloc.txt").write_text(allocation_report(job_name))
+
+    summary = _run_dir / "summary.txt"
+    summary.write_text(f"Profiled jobs: {', '.join(sorted(_profiles))}\n\n" + hottest(paths))
+
+    logger.info(f"Profiles of {len(paths)} jobs written to {_run_dir}")
+    return _run_dir
@@ -0,0 +1,244 @@
+import logging
+import os
+import re
+import threading
+import time
+from datetime import date, datetime
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+from google.api_core.exceptions import NotFound, PermissionDenied
+from google.cloud import bigquery
+
+from technical_indicators import bq_client, job_ledger, local_store, openmetrics, query_cache, tracing
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def backend_name() -> str:
+    """
+    'bigquery' (default) or 'duckdb', which runs the same SQL over the local store without credentials
+    """
+    return os.getenv('QUERY_BACKEND', 'bigquery').lower()
+
+
+def run_query(credentials, sql: str, params: dict | None = None) -> tuple[pd.DataFrame, int]:
+    """
+    run BigQuery standard SQL on the configured backend. params fill the @name placeholders.
+    returns the result and the bytes processed (0 for local queries)
+    """
+    backend = backend_name()
+    start = time.perf_counter()
+
+    with tracing.span('query', backend=backend) as attributes:
+        key = None
+        if query_cache.enabled():
+            versions = table_versions(credentials, sql, backend)
+            if versions is not None:
+                key = query_cache.cache_key(backend, sql, params, versions)
+                table = query_cache.lookup(key)
+                if table is not None:
+                    logger.info(f"Query served from the cache ({table.num_rows} rows)")
+                    attributes.update(cached=True, rows=table.num_rows, bytes_processed=0)
+                    openmetrics.inc('query_cache_requests', backend=backend, result='hit')
+                    openmetrics.observe('query_duration_seconds', time.perf_counter() - start, backend=backend)
+                    return to_frame(table), 0
+
+        if backend == 'duckdb':
+            table, bytes_processed = duckdb_table(sql, params), 0
+        else:
+            table, bytes_processed = bigquery_table(credentials, sql, params)
+
+        if key is not None:
+            query_cache.store(key, table)
+
+        attributes.update(cached=False, rows=table.num_rows, bytes_processed=bytes_processed)
+
+    openmetrics.inc('query_cache_requests', backend=backend, result='miss' if query_cache.enabled() else 'off')
+    openmetrics.observe('query_duration_seconds', time.perf_counter() - start, backend=backend)
+
+    return to_frame(table), bytes_processed
+
+
+def table_versions(credentials, sql: str, backend: str) -> dict[str, str] | None:
+    """
+    modification time of every table the query reads, None when one of them cannot be found
+    """
+    versions = {}
+
+    if backend == 'duckdb':
+        for table_name in set(re.findall(r"\bsignals\.(\w+)", translate(sql))):
+            path = local_store.table_path(table_name)
+            if not path.exists():
+                return None
+            versions[table_name] = str(path.stat().st_mtime_ns)
+        return versions
+
+    client = bq_client.get_client(credentials, project=credentials.project_id)
+    for reference in set(re.findall(r"([\w-]+\.\w+\.\w+)", sql.replace('`', ''))):
+        try:
+            versions[reference] = client.get_table(reference).modified.isoformat()
+        except NotFound:
+            return None
+    return versions
+
+
+def arrow_dtypes() -> bool:
+    """
+    QUERY_ARROW_DTYPES=1 keeps the arrow types in the returned frames instead of numpy/object columns
+    """
+    return os.getenv('QUERY_ARROW_DTYPES') == '1'
+
+
+def to_frame(table: pa.Table) -> pd.DataFrame:
+    if arrow_dtypes():
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+    return table.to_pandas()
+
+
+def query_parameter(name: str, value) -> bigquery.ScalarQueryParameter:
+    if isinstance(value, datetime):
+        kind = 'TIMESTAMP'
+    elif isinstance(value, date):
+        kind = 'DATE'
+    elif isinstance(value, bool):
+        kind = 'BOOL'
+    elif isinstance(value, int):
+        kind = 'INT64'
+    elif isinstance(value, float):
+        kind = 'FLOAT64'
+    else:
+        kind = 'STRING'
+
+    return bigquery.ScalarQueryParameter(name, kind, value)
+
+
+def run_bigquery(credentials, sql: str, params: dict | None = None) -> tuple[pd.DataFrame, int]:
+    """
+    run sql on BigQuery whatever the configured backend, for sources that only exist there
+    """
+    if credentials is None:
+        raise ValueError("this source is only on BigQuery, it needs credentials (QUERY_BACKEND=bigquery)")
+
+    table, bytes_processed = bigquery_table(credentials, sql, params)
+    return to_frame(table), bytes_processed
+
+
+def bigquery_table(credentials, sql: str, params: dict | None = None) -> tuple[pa.Table, int]:
+    client = bq_client.get_client(credentials, project=credentials.project_id)
+
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[query_parameter(name, value) for name, value in (params or {}).items()]
+    )
+
+    query_job = client.query(sql, job_config=job_config)
+    results = query_job.result()
+
+    # Results larger than the first page are streamed over the Storage Read API, small ones stay on REST
+    try:
+        table = results.to_arrow(bqstorage_client=bq_client.get_read_client(credentials))
+    except PermissionDenied as e:
+        logger.warning(f"Storage Read API not available, downloading over REST: {e}")
+        table = query_job.result().to_arrow(create_bqstorage_client=False)
+
+    job_ledger.add_query(query_job)
+
+    bytes_processed = query_job.total_bytes_processed or 0
+    logger.info(f"Query processed {bytes_processed:,} bytes ({bytes_processed / 1024 / 1024:.2f} MB)")
+
+    return table, bytes_processed
+
+
+def connection():
+    """
+    one in-memory duckdb connection per thread
+    """
+    if getattr(_local, 'connection', None) is None:
+        _local.connection = duckdb.connect()
+        _local.connection.execute("CREATE SCHEMA IF NOT EXISTS signals")
+
+    return _local.connection
+
+
+def duckdb_table(sql: str, params: dict | None = None) -> pa.Table:
+    sql = translate(sql)
+    con = connection()
+
+    # Tables are exposed as views over their parquet partitions, rebuilt so new writes are visible
+    for table_name in sorted(set(re.findall(r"\bsignals\.(\w+)", sql))):
+        path = local_store.table_path(table_name)
+        if not path.exists():
+            raise FileNotFoundError(f"{table_name} is not in the local store, run main.py locally first")
+        con.execute(
+            f"CREATE OR REPLACE VIEW signals.{table_name} AS "
+            f"SELECT * EXCLUDE (month) FROM read_parquet('{path.as_posix()}/*/*.parquet', hive_partitioning = true)"
+        )
+
+    table = con.execute(sql, params or {}).fetch_arrow_table()
+    logger.info(f"Local query returned {table.num_rows} rows")
+
+    return table
+
+
+def split_arguments(text: str) -> list[str]:
+    """
+    top level comma separated arguments of a function call
+    """
+    arguments, depth, current = [], 0, ''
+    for char in text:
+        if char == ',' and depth == 0:
+            arguments.append(current.strip())
+            current = ''
+            continue
+        depth += char == '('
+        depth -= char == ')'
+        current += char
+    arguments.append(current.strip())
+    return arguments
+
+
+def rewrite_calls(sql: str, name: str, rewrite) -> str:
+    """
+    replace every call of the SQL function name, rewrite(arguments) returns the new expression
+    """
+    pattern = re.compile(rf"(?<![\w.]){name}\s*\(", re.IGNORECASE)
+    position = 0
+
+    while (match := pattern.search(sql, position)) is not None:
+        depth, end = 1, match.end()
+        while depth:
+            depth += sql[end] == '('
+            depth -= sql[end] == ')'
+            end += 1
+        # Nested calls first, the search then resumes after the replacement so it is never rewritten twice
+        arguments = split_arguments(rewrite_calls(sql[match.end():end - 1], name, rewrite))
+        replacement = rewrite(arguments)
+        sql = sql[:match.start()] + replacement + sql[end:]
+        position = match.start() + len(replacement)
+
+    return sql
+
+
+def translate(sql: str) -> str:
+    """
+    BigQuery standard SQL to the duckdb dialect, for the constructs the pipeline uses
+    """
+    sql = sql.replace('`', '')
+    sql = re.sub(r"\b[\w-]+\.signals\.(\w+)", r"signals.\1", sql)
+    sql = re.sub(r"\bCURRENT_DATE\s*\(\s*\)", "CURRENT_DATE", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bCURRENT_TIMESTAMP\s*\(\s*\)", "CURRENT_TIMESTAMP", sql, flags=re.IGNORECASE)
+
+    sql = rewrite_calls(sql, 'DATE_SUB', lambda args: f"CAST(({args[0]}) - {args[1]} AS DATE)")
+    sql = rewrite_calls(sql, 'DATE_ADD', lambda args: f"CAST(({args[0]}) + {args[1]} AS DATE)")
+    sql = rewrite_calls(sql, 'DATE_TRUNC', lambda args: f"CAST(date_trunc('{args[1].lower()}', {args[0]}) AS DATE)")
+    sql = rewrite_calls(sql, 'SAFE_DIVIDE', lambda args: f"(({args[0]}) / NULLIF({args[1]}, 0))")
+    sql = rewrite_calls(sql, 'DATE', lambda args: f"CAST({args[0]} AS DATE)")
+
+    # Named parameters are @name in BigQuery and $name in duckdb
+    sql = re.sub(r"@(\w+)", r"$\1", sql)
+
+    return sql
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+cache_dir = Path(os.getenv('QUERY_CACHE_DIR', Path(__file__).parent.parent / ".query_cache"))
+
+# Results beyond this size are evicted least recently used first
+max_bytes = int(float(os.getenv('QUERY_CACHE_MAX_MB', '256')) * 1024 * 1024)
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    """
+    the cache is opt-in with QUERY_CACHE=1, main turns it on in local mode
+    """
+    return os.getenv('QUERY_CACHE') == '1'
+
+
+def normalize(sql: str) -> str:
+    """
+    sql without comments and with whitespace collapsed, so formatting does not change the key
+    """
+    sql = re.sub(r"--[^\n]*", "", sql)
+    return " ".join(sql.split())
+
+
+def cache_key(backend: str, sql: str, params: dict | None, table_versions: dict[str, str]) -> str:
+    """
+    hash of the backend, the normalized sql, its parameters and the modification time of every
+    table it reads. queries using the current date also depend on today, in UTC like BigQuery's CURRENT_DATE()
+    """
+    sql = normalize(sql)
+    items = sorted((str(key), str(value)) for key, value in (params or {}).items())
+    today = datetime.now(timezone.utc).date().isoformat() if re.search(r"\bCURRENT_(DATE|TIMESTAMP)\b", sql, re.IGNORECASE) else None
+
+    return hashlib.sha256(json.dumps([backend, sql, items, sorted(table_versions.items()), today]).encode()).hexdigest()
+
+
+def lookup(key: str) -> pa.Table | None:
+    """
+    cached result for key, None when nothing is cached
+    """
+    path = cache_dir / f"{key}.parquet"
+
+    try:
+        table = pq.read_table(path)
+    except (OSError, pa.ArrowInvalid):
+        return None
+
+    # The file's mtime is the recency used for eviction
+    os.utime(path)
+
+    return table
+
+
+def store(key: str, table: pa.Table) -> None:
+    """
+    keep a query result, then evict old entries beyond max_bytes
+    """
+    with _lock:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        staging = cache_dir / f".{key}-{threading.get_ident()}"
+        pq.write_table(table, staging)
+        staging.replace(cache_dir / f"{key}.parquet")
+        evict()
+
+
+def evict() -> None:
+    """
+    drop least recently used results until the cache fits max_bytes
+    """
+    results = sorted(cache_dir.glob("*.parquet"), key=lambda path: path.stat().st_mtime)
+    total = sum(path.stat().st_size for path in results)
+
+    for path in results:
+        if total <= max_bytes:
+            break
+        total -= path.stat().st_size
+        path.unlink(missing_ok=True)
+        logger.info(f"evicted {path.stem} from the query cache")
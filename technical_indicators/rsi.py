@@ -1,21 +1,22 @@
 import pandas as pd
-import pandas_gbq
-from google.cloud import bigquery
 import logging
-from pathlib import Path
-import os
-
-current_dir = Path(__file__).parent
-local_folder = current_dir / "testing_area"
-local_folder_string = str(local_folder.resolve())
+from technical_indicators import bitcoin_closing_prices, bq_client, etl_state, indicator_engine, local_store, query_backend, table_snapshot, tracing
 
 
 destination_table = "btc_rsi"
 
+depends_on = ["bitcoin_closing_prices"]
+
 logger = logging.getLogger(__name__)
 
-def calculate_rsi(credentials) -> tuple[pd.DataFrame, int]:
-    client = bigquery.Client(credentials=credentials, project=credentials.project_id)
+def fetch_prices(credentials, prices: pd.DataFrame | None = None) -> tuple[pd.DataFrame, int]:
+    """
+    closed bitcoin prices, oldest first. prices is the bitcoin_price table published by this run,
+    when given the query is skipped
+    """
+    if prices is not None:
+        df = table_snapshot.closed_rows(prices, 'timestamp')[['timestamp', 'price']].copy()
+        return df, 0
 
     query = """
     SELECT
@@ -25,32 +26,46 @@ def calculate_rsi(credentials) -> tuple[pd.DataFrame, int]:
     WHERE DATE(timestamp) < DATE(CURRENT_TIMESTAMP())
     ORDER BY 1
     """
-    query_job = client.query(query)
-    results = query_job.result()
-    df = results.to_dataframe()
-
-    bytes_processed = query_job.total_bytes_processed
-    logger.info(f"Query processed {bytes_processed:,} bytes ({bytes_processed / 1024 / 1024:.2f} MB)")
 
-    # Calculate price changes
-    df['price_change'] = df['price'].diff()
+    return query_backend.run_query(credentials, query)
 
-    # Separate gains and losses
-    df['gain'] = df['price_change'].where(df['price_change'] > 0, 0)
-    df['loss'] = (-df['price_change']).where(df['price_change'] < 0, 0)
+def calculate_rsi(credentials, prices: pd.DataFrame | None = None) -> tuple[pd.DataFrame, int]:
+    """
+    prices is the bitcoin_price table published by this run, when given the query is skipped
+    """
+    df, bytes_processed = fetch_prices(credentials, prices)
+    rsi_result, _ = compute_rsi(df)
 
-    # Calculate 14-period average gains and losses using exponential moving average
-    df['avg_gain'] = df['gain'].ewm(span=14, adjust=False).mean()
-    df['avg_loss'] = df['loss'].ewm(span=14, adjust=False).mean()
+    return rsi_result, bytes_processed
 
-    # Calculate RSI
-    df['rs'] = df['avg_gain'] / df['avg_loss']
-    df['rsi_14'] = 100 - (100 / (1 + df['rs']))
+@tracing.traced('transform')
+def compute_rsi(df: pd.DataFrame, previous: dict | None = None) -> tuple[pd.DataFrame, dict | None]:
+    """
+    RSI for the price rows in df, continuing from the persisted last price and averages in previous
+    when given. also returns the state at the last final row (None when there is none yet)
+    """
+    # Calculate RSI, gains and losses are averaged with a 14-period exponential moving average
+    prices = indicator_engine.as_price_array(df['price'])
+    if previous:
+        previous = (previous['last_price'], previous['avg_gain'], previous['avg_loss'])
+    avg_gain, avg_loss = indicator_engine.rsi_averages(prices, period=14, previous=previous)
 
     # Return timestamp and RSI
-    rsi_result = df[['timestamp', 'rsi_14']].copy()
+    rsi_result = df[['timestamp']].copy()
+    rsi_result['rsi_14'] = indicator_engine.relative_strength(avg_gain, avg_loss)
 
-    return rsi_result, bytes_processed
+    index = etl_state.checkpoint_index(len(df))
+    if index is None:
+        return rsi_result, None
+
+    state = {
+        'last_date': pd.Timestamp(df['timestamp'].iloc[index]).date().isoformat(),
+        'last_price': float(prices[index]),
+        'avg_gain': float(avg_gain[index]),
+        'avg_loss': float(avg_loss[index])
+    }
+
+    return rsi_result, state
 
 def schema() -> list[dict]:
     """
@@ -63,33 +78,50 @@ def schema() -> list[dict]:
     ]
     return table_schema
 
-def run_etl(credentials, dataset: str, mode: str) -> int:
+def extract(credentials, dataset: str, mode: str) -> dict:
+    """
+    price rows after the persisted checkpoint on incremental runs, otherwise all closed prices
+    """
+    if mode == 'prod' and etl_state.incremental_enabled():
+        return etl_state.extract_incremental(credentials, dataset, destination_table, bitcoin_closing_prices.prices_after)
+
+    df, bytes_processed = fetch_prices(credentials, prices=table_snapshot.get("bitcoin_price"))
+    return {'rows': df, 'bytes_processed': bytes_processed}
+
+def transform(payload: dict) -> dict:
+    if payload.get('incremental'):
+        return etl_state.transform_incremental(payload, compute_rsi)
+
+    table, _ = compute_rsi(payload['rows'])
+    return {'table': table, 'bytes_processed': payload['bytes_processed']}
+
+def load(credentials, dataset: str, mode: str, payload: dict) -> int:
+
+    if payload.get('incremental'):
+        return etl_state.load_incremental(credentials, dataset, destination_table, schema(), payload)
+
+    table, bytes_processed = payload['table'], payload['bytes_processed']
 
     if mode == 'prod':
 
-        table, bytes_processed = calculate_rsi(credentials)
         table_schema = schema()
         target_table = dataset + destination_table
 
-        pandas_gbq.to_gbq(
+        bq_client.merge_rows(
             dataframe=table,
             destination_table=target_table,
-            project_id="connection-123",
             table_schema=table_schema,
             credentials=credentials,
-            if_exists="replace"
+            key_columns=['timestamp']
         )
 
         return bytes_processed
 
     else:
         print('test mode')
-        table, bytes_processed = calculate_rsi(credentials)
-        # Create subdirectory if it doesn't exist
-        subdir = local_folder / calculate_rsi.__name__
-        subdir.mkdir(parents=True, exist_ok=True)
-
-        csv_filename = os.path.join(str(subdir), "data.csv")
-        table.to_csv(csv_filename, index=False)
-        print(f'Data saved to {csv_filename}')
+        path = local_store.write(destination_table, table, schema(), 'timestamp')
+        print(f'Data saved to {path}')
         return bytes_processed
+
+def run_etl(credentials, dataset: str, mode: str) -> int:
+    return load(credentials, dataset, mode, transform(extract(credentials, dataset, mode)))
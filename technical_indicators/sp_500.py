@@ -1,23 +1,27 @@
 import yfinance as yf
 import pandas as pd
-from google.cloud import bigquery
 import logging
-import os
-from pathlib import Path
+from datetime import date
+from technical_indicators import local_store, tracing, watermark
 
-current_dir = Path(__file__).parent
-local_folder = current_dir / "testing_area"
-local_folder_string = str(local_folder.resolve())
 
 destination_table = "gspc"
 
-logger = logging.getLogger(__name__)
+depends_on = []
 
-def fetch_gspc(ticker:str = "^GSPC", period:str = "1y") -> pd.DataFrame:
+logger = logging.getLogger(__name__)
 
+@tracing.traced('fetch')
+def fetch_gspc(ticker:str = "^GSPC", period:str = "1y", start: date | None = None) -> pd.DataFrame:
+    """
+    daily closes over period, or only from start onwards when the table is already loaded
+    """
     # Download S&P 500 data
     ticker = yf.Ticker(ticker)  # ^GSPC is the S&P 500 index symbol
-    df = ticker.history(period=period)
+    if start is not None:
+        df = ticker.history(start=start.isoformat())
+    else:
+        df = ticker.history(period=period)
 
     close_prices = df['Close']
     df = pd.DataFrame(close_prices)
@@ -37,45 +41,36 @@ def schema() -> list[dict]:
     return table_schema
 
 
-def run_etl(credentials,dataset:str,mode:str) -> int:
-
+def extract(credentials, dataset: str, mode: str) -> dict:
+    """
+    on incremental prod runs only the range past the watermark is fetched
+    """
+    start = None
     if mode == 'prod':
+        start = watermark.fetch_start(watermark.load(credentials, dataset, destination_table))
 
-        project = "connection-123"
-        client = bigquery.Client(credentials=credentials, project=project)
-        table = fetch_gspc()
-        table_schema = schema()
+    return {'table': fetch_gspc(start=start), 'start': start, 'bytes_processed': 0}
 
-        job_config = bigquery.LoadJobConfig(
-            schema=table_schema,
-            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-            time_partitioning=bigquery.TimePartitioning(
-                type_=bigquery.TimePartitioningType.DAY,
-                field="date"
-            ),
-            destination_table_description="daily figures for the sp500 (last 20 years)"
-        )
+def load(credentials, dataset: str, mode: str, payload: dict) -> int:
+    table = payload['table']
 
-        table_ref = dataset + destination_table
+    if mode == 'prod':
 
-        job = client.load_table_from_dataframe(
-            table,
-            table_ref,
-            job_config=job_config
-        )
+        table_schema = schema()
 
-        job.result()
+        watermark.write(
+            credentials, dataset, destination_table, table, table_schema, 'date',
+            partition_field="date",
+            description="daily figures for the sp500 (last 20 years)"
+        )
 
         return 0
 
     else:
         print('test mode')
-        table = fetch_gspc()
-        # Create subdirectory if it doesn't exist
-        subdir = local_folder / fetch_gspc.__name__
-        subdir.mkdir(parents=True, exist_ok=True)
-
-        csv_filename = os.path.join(str(subdir), "data.csv")
-        table.to_csv(csv_filename, index=False)
-        print(f'Data saved to {csv_filename}')
+        path = local_store.write(destination_table, table, schema(), 'date')
+        print(f'Data saved to {path}')
         return 0
+
+def run_etl(credentials, dataset: str, mode: str) -> int:
+    return load(credentials, dataset, mode, extract(credentials, dataset, mode))
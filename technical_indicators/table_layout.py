@@ -0,0 +1,223 @@
+import logging
+import math
+import os
+from datetime import date, timedelta
+
+import pandas as pd
+from google.cloud import bigquery
+
+# BigQuery rejects loads and queries that write to more partitions than this
+max_partitions = 4000
+
+# Years of growth the chosen partitioning has to absorb before it would hit max_partitions
+growth_years = 10
+
+# Below this many rows per partition on average the next coarser granularity is used
+min_rows_per_partition = int(os.getenv('BQ_MIN_ROWS_PER_PARTITION', '28'))
+
+# Average days covered by one partition of each granularity, finest first
+granularities = {'DAY': 1, 'MONTH': 30.4375, 'YEAR': 365.25}
+
+date_types = ('DATE', 'TIMESTAMP', 'DATETIME')
+
+logger = logging.getLogger(__name__)
+
+
+def choose_granularity(history_days: int, rows: int) -> str:
+    """
+    finest partitioning that keeps enough rows per partition and stays under max_partitions
+    for the next growth_years
+    """
+    rows_per_day = rows / max(history_days, 1)
+    horizon = history_days + growth_years * 365
+
+    for granularity, days in granularities.items():
+        if math.ceil(horizon / days) <= max_partitions and rows_per_day * days >= min_rows_per_partition:
+            return granularity
+
+    return 'YEAR'
+
+
+def choose_layout(dataframe: pd.DataFrame, table_schema: list[dict], date_column: str,
+                  cluster_columns: list[str] | None = None) -> dict:
+    """
+    partitioning and clustering for a table holding dataframe. the pipeline filters and joins on
+    date_column, so it is the partition field and the first clustering column. columns that are not
+    DATE/TIMESTAMP (e.g. dates kept as strings) can only be clustered on
+    """
+    types = {field['name']: field['type'].upper() for field in table_schema}
+    clustering = cluster_columns or [date_column]
+
+    if types.get(date_column) not in date_types or dataframe.empty:
+        return {'partitioning': None, 'field': None, 'clustering': clustering}
+
+    dates = pd.to_datetime(dataframe[date_column])
+    history_days = (dates.max() - dates.min()).days + 1
+
+    return {
+        'partitioning': choose_granularity(history_days, len(dataframe)),
+        'field': date_column,
+        'clustering': clustering
+    }
+
+
+def apply(job_config: bigquery.LoadJobConfig, layout: dict) -> bigquery.LoadJobConfig:
+    """
+    set the layout on the load job that creates a table
+    """
+    if layout['partitioning'] is not None:
+        job_config.time_partitioning = bigquery.TimePartitioning(type_=layout['partitioning'], field=layout['field'])
+    job_config.clustering_fields = layout['clustering']
+    return job_config
+
+
+def current_layout(table: bigquery.Table) -> dict:
+    partitioning = table.time_partitioning
+    return {
+        'partitioning': partitioning.type_ if partitioning is not None else None,
+        'field': partitioning.field if partitioning is not None else None,
+        'clustering': list(table.clustering_fields or [])
+    }
+
+
+def partition_expression(field: str, field_type: str, granularity: str) -> str:
+    if field_type == 'DATE':
+        return f"`{field}`" if granularity == 'DAY' else f"DATE_TRUNC(`{field}`, {granularity})"
+    if field_type == 'DATETIME':
+        return f"DATETIME_TRUNC(`{field}`, {granularity})"
+    return f"TIMESTAMP_TRUNC(`{field}`, {granularity})"
+
+
+def history(client: bigquery.Client, table: bigquery.Table, date_column: str) -> tuple[int, int]:
+    """
+    days between the first and last date_column value of the table, and its row count
+    """
+    query = f"""
+        SELECT
+          DATE_DIFF(DATE(MAX(`{date_column}`)), DATE(MIN(`{date_column}`)), DAY) + 1 AS days,
+          COUNT(*) AS row_count
+        FROM `{table.full_table_id.replace(':', '.')}`
+    """
+    row = list(client.query(query).result())[0]
+    return row['days'] or 0, row['row_count']
+
+
+def migration_ddl(table_id: str, target_id: str, field_types: dict[str, str], layout: dict) -> str:
+    """
+    statement copying table_id into a new table target_id with layout. BigQuery does not replace a
+    table with one partitioned differently, so the copy cannot be written over table_id itself
+    """
+    ddl = f"CREATE TABLE `{target_id}`"
+    if layout['partitioning'] is not None:
+        field = layout['field']
+        ddl += f"\nPARTITION BY {partition_expression(field, field_types[field], layout['partitioning'])}"
+    if layout['clustering']:
+        ddl += f"\nCLUSTER BY {', '.join(f'`{column}`' for column in layout['clustering'])}"
+    ddl += f"\nAS SELECT * FROM `{table_id}`"
+    return ddl
+
+
+def migrate(client: bigquery.Client, table: bigquery.Table, layout: dict) -> None:
+    """
+    rewrite the table with layout: the rows are copied into <table>_migrating with the new layout,
+    then the original is dropped and the copy takes its id. CREATE TABLE AS drops the descriptions,
+    they are put back. readers find no table between the drop and the copy, a failed copy leaves
+    the rows in <table>_migrating
+    """
+    table_id = table.full_table_id.replace(':', '.')
+    migrating_id = f"{table_id}_migrating"
+    field_types = {field.name: field.field_type for field in table.schema}
+
+    client.delete_table(migrating_id, not_found_ok=True)
+    client.query(migration_ddl(table_id, migrating_id, field_types, layout)).result()
+
+    # A copy job keeps the partitioning and clustering of its source
+    client.delete_table(table_id)
+    client.copy_table(migrating_id, table_id).result()
+    client.delete_table(migrating_id, not_found_ok=True)
+
+    migrated = client.get_table(table_id)
+    migrated.schema = table.schema
+    migrated.description = table.description
+    client.update_table(migrated, ['schema', 'description'])
+
+    logger.info(f"{table.table_id}: layout changed from {current_layout(table)} to {layout}")
+
+
+def manage(client: bigquery.Client, dataset: str, skip: tuple[str, ...] = ()) -> dict[str, dict]:
+    """
+    choose the layout of every table in dataset from its history and migrate the ones that differ.
+    the date column is the current partition field, else the first DATE/TIMESTAMP column.
+    returns the layout per table
+    """
+    layouts = {}
+
+    for item in client.list_tables(dataset):
+        if item.table_id in skip or '_staging_' in item.table_id or item.table_id.endswith('_migrating'):
+            continue
+
+        table = client.get_table(item.reference)
+        current = current_layout(table)
+        date_column = current['field'] or next(
+            (field.name for field in table.schema if field.field_type in date_types), None
+        )
+        if date_column is None:
+            continue
+
+        days, rows = history(client, table, date_column)
+        layout = {'partitioning': choose_granularity(days, rows), 'field': date_column,
+                  'clustering': current['clustering'] or [date_column]}
+        layouts[table.table_id] = layout
+
+        if layout != current:
+            migrate(client, table, layout)
+
+    return layouts
+
+
+def check_pruning(client: bigquery.Client, queries: dict[str, tuple[str, dict]], threshold: float = 0.5) -> dict[str, bool]:
+    """
+    dry run every named (sql, params) and compare the bytes it would scan with the size of the tables
+    it references. a query scanning more than threshold of them is not pruning partitions
+    """
+    from technical_indicators import query_backend
+
+    pruned = {}
+    for name, (sql, params) in queries.items():
+        job_config = bigquery.QueryJobConfig(
+            dry_run=True,
+            use_query_cache=False,
+            query_parameters=[query_backend.query_parameter(key, value) for key, value in params.items()]
+        )
+        query_job = client.query(sql, job_config=job_config)
+        table_bytes = sum(client.get_table(reference).num_bytes or 0 for reference in query_job.referenced_tables)
+
+        scanned = query_job.total_bytes_processed or 0
+        pruned[name] = table_bytes == 0 or scanned <= threshold * table_bytes
+        log = logger.info if pruned[name] else logger.warning
+        log(f"{name}: scans {scanned:,} of {table_bytes:,} table bytes{'' if pruned[name] else ', partitions are not pruned'}")
+
+    return pruned
+
+
+def main() -> None:
+    import bitcoin_predictor
+    from technical_indicators import bitcoin_closing_prices, bitcoin_ema, bq_client, etl_state
+
+    credentials = bq_client.get_credentials("connection-123-892e002c2def.json")
+    client = bq_client.get_client(credentials)
+
+    manage(client, f"{bq_client.project_id}.signals", skip=(etl_state.state_table,))
+
+    # The date filtered reads of the incremental runs, with a typical checkpoint
+    after = date.today() - timedelta(days=30)
+    check_pruning(client, {
+        'bitcoin_price after checkpoint': (bitcoin_closing_prices.prices_after_query, {'after': after}),
+        'btc_ema after checkpoint': (bitcoin_ema.emas_after_query, {'after': after}),
+        'predictor indicators': (bitcoin_predictor.indicators_query, {})
+    })
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
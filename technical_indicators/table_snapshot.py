@@ -0,0 +1,73 @@
+import logging
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Run-scoped copies of tables that upstream jobs just wrote, keyed by destination table
+_lock = threading.Lock()
+_tables = {}
+
+
+def publish(table_name: str, dataframe: pd.DataFrame, complete: bool = True) -> None:
+    """
+    keep the frame a job just loaded so downstream jobs can read it without querying bigquery.
+    complete=False marks frames holding only the newest rows of the table (incremental runs)
+    """
+    with _lock:
+        _tables[table_name] = (dataframe.copy(), complete)
+
+    logger.info(f"published {len(dataframe)} rows of {table_name} to the run snapshot")
+
+
+def get(table_name: str) -> pd.DataFrame | None:
+    """
+    copy of the published table, or None when no job of this run produced the whole table
+    """
+    with _lock:
+        dataframe, complete = _tables.get(table_name, (None, False))
+
+    if dataframe is None or not complete:
+        return None
+
+    return dataframe.copy()
+
+
+def rows_after(table_name: str, last_date: date, date_column: str) -> pd.DataFrame | None:
+    """
+    published rows dated after last_date, oldest first. None when the snapshot does not
+    reach back to the day after last_date, since rows in between would be missing
+    """
+    with _lock:
+        dataframe, complete = _tables.get(table_name, (None, False))
+
+    if dataframe is None:
+        return None
+
+    dates = pd.to_datetime(dataframe[date_column]).dt.date
+    if not complete and (dates.empty or dates.min() > last_date + timedelta(days=1)):
+        return None
+
+    rows = closed_rows(dataframe[dates > last_date], date_column)
+
+    return rows.copy()
+
+
+def clear() -> None:
+    with _lock:
+        _tables.clear()
+
+
+def closed_rows(dataframe: pd.DataFrame, date_column: str) -> pd.DataFrame:
+    """
+    rows dated before the current UTC day, oldest first.
+    same rows as the `WHERE date < CURRENT_DATE() ORDER BY date` queries against the table
+    """
+    today = datetime.now(timezone.utc).date()
+    dates = pd.to_datetime(dataframe[date_column]).dt.date
+
+    closed = dataframe[dates < today]
+
+    return closed.sort_values(date_column).reset_index(drop=True)
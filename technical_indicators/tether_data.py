@@ -1,27 +1,27 @@
 import pandas as pd
-import requests
-from google.cloud import bigquery
 import logging
-import os
-from pathlib import Path
-
-current_dir = Path(__file__).parent
-local_folder = current_dir / "testing_area"
-local_folder_string = str(local_folder.resolve())
+from datetime import date
+from technical_indicators import http_client, local_store, tracing, watermark
 
 
 destination_table = "tether_data"
 
+depends_on = []
+
 logger = logging.getLogger(__name__)
 
-def fetch_tether_data() -> pd.DataFrame:
+@tracing.traced('fetch')
+def fetch_tether_data(start: date | None = None) -> pd.DataFrame:
+    """
+    daily market cap and volume for the last year, or only from start onwards when the table is already loaded
+    """
     url = 'https://api.coingecko.com/api/v3/coins/tether/market_chart'
     params = {
         'vs_currency': 'usd',
-        'days': '365',
+        'days': str(watermark.days_since(start, default=365)),
         'interval': 'daily'
     }
-    response = requests.get(url, params=params)
+    response = http_client.get(url, params=params)
     response.raise_for_status()
     data = response.json()
 
@@ -48,6 +48,9 @@ def fetch_tether_data() -> pd.DataFrame:
     df = df.groupby('date', as_index=False).last()
     df = df.rename(columns={'date': 'timestamp'})
 
+    if start is not None:
+        df = df[df['timestamp'] >= start].reset_index(drop=True)
+
     logger.info(f"imported {len(df)} rows of data from {url}")
 
     return df
@@ -64,45 +67,36 @@ def schema() -> list[dict]:
     return table_schema
 
 
-def run_etl(credentials,dataset:str,mode:str) -> int:
-
+def extract(credentials, dataset: str, mode: str) -> dict:
+    """
+    on incremental prod runs only the range past the watermark is fetched
+    """
+    start = None
     if mode == 'prod':
+        start = watermark.fetch_start(watermark.load(credentials, dataset, destination_table))
 
-        project = "connection-123"
-        client = bigquery.Client(credentials=credentials, project=project)
-        table = fetch_tether_data()
-        table_schema = schema()
+    return {'table': fetch_tether_data(start), 'start': start, 'bytes_processed': 0}
 
-        job_config = bigquery.LoadJobConfig(
-            schema=table_schema,
-            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-            time_partitioning=bigquery.TimePartitioning(
-                type_=bigquery.TimePartitioningType.DAY,
-                field="timestamp"
-            ),
-            destination_table_description="market cap and daily volume for usdt"
-        )
+def load(credentials, dataset: str, mode: str, payload: dict) -> int:
+    table = payload['table']
 
-        table_ref = dataset + destination_table
+    if mode == 'prod':
 
-        job = client.load_table_from_dataframe(
-            table,
-            table_ref,
-            job_config=job_config
-        )
+        table_schema = schema()
 
-        job.result()
+        watermark.write(
+            credentials, dataset, destination_table, table, table_schema, 'timestamp',
+            partition_field="timestamp",
+            description="market cap and daily volume for usdt"
+        )
 
         return 0
 
     else:
         print('test mode')
-        table = fetch_tether_data()
-        # Create subdirectory if it doesn't exist
-        subdir = local_folder / fetch_tether_data.__name__
-        subdir.mkdir(parents=True, exist_ok=True)
-
-        csv_filename = os.path.join(str(subdir), "data.csv")
-        table.to_csv(csv_filename, index=False)
-        print(f'Data saved to {csv_filename}')
+        path = local_store.write(destination_table, table, schema(), 'timestamp')
+        print(f'Data saved to {path}')
         return 0
+
+def run_etl(credentials, dataset: str, mode: str) -> int:
+    return load(credentials, dataset, mode, extract(credentials, dataset, mode))
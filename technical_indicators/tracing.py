@@ -0,0 +1,106 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+trace_path = Path(os.getenv('ETL_TRACE_PATH', Path(__file__).parent.parent / "traces.jsonl"))
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_run_id = None
+
+# Innermost open span of the current thread or task, new spans become its children
+_current = contextvars.ContextVar('span', default=None)
+
+
+def enabled() -> bool:
+    """
+    ETL_TRACE=0 turns the spans off, they are written by default
+    """
+    return os.getenv('ETL_TRACE', '1') != '0'
+
+
+def start_run(run_id: str) -> None:
+    """
+    tag every span from now on with run_id
+    """
+    global _run_id
+    _run_id = run_id
+
+
+def run_id() -> str:
+    global _run_id
+    if _run_id is None:
+        _run_id = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    return _run_id
+
+
+@contextmanager
+def span(name: str, job: str | None = None, **attributes):
+    """
+    time the block as one span. job defaults to the job of the enclosing span.
+    yields the attributes, so the block can add the rows or bytes it handled
+    """
+    if not enabled():
+        yield attributes
+        return
+
+    parent = _current.get()
+    record = {
+        'run_id': run_id(),
+        'job': job if job is not None else (parent['job'] if parent else None),
+        'span_id': uuid.uuid4().hex[:16],
+        'parent_id': parent['span_id'] if parent else None,
+        'name': name,
+        'start': datetime.now(timezone.utc).isoformat(timespec='microseconds')
+    }
+    token = _current.set(record)
+    start = time.perf_counter()
+    status, error = 'ok', None
+    try:
+        yield attributes
+    except BaseException as e:
+        status, error = 'error', f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 6)
+        record['status'] = status
+        if error is not None:
+            record['error'] = error
+        record['thread'] = threading.current_thread().name
+        _current.reset(token)
+        emit({**record, **attributes})
+
+
+def traced(name: str):
+    """
+    decorator running every call of the function inside a span
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, function=function.__qualname__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def emit(record: dict) -> None:
+    """
+    append one span as a json line, spans are written as they close so children come first
+    """
+    try:
+        with _lock:
+            trace_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(trace_path, 'a') as f:
+                f.write(json.dumps(record, default=str) + "\n")
+    except OSError as e:
+        logger.warning(f"Span {record['name']} not written: {e}")
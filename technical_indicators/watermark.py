@@ -0,0 +1,90 @@
+import logging
+from datetime import date, datetime, timedelta, timezone
+
+import pandas as pd
+
+from technical_indicators import bq_client, etl_state
+
+# Days re-fetched before the watermark, sources revise their latest readings for a day or two
+overlap_days = 2
+
+logger = logging.getLogger(__name__)
+
+
+def state_name(destination_table: str) -> str:
+    """
+    name of the watermark entry in the etl_state table
+    """
+    return f"watermark.{destination_table}"
+
+
+def load(credentials, dataset: str, destination_table: str) -> date | None:
+    """
+    last date loaded into destination_table, None when the table was never loaded
+    incrementally or incremental mode is off
+    """
+    if not etl_state.incremental_enabled():
+        return None
+
+    state = etl_state.load(credentials, dataset, state_name(destination_table))
+    if state is None:
+        return None
+
+    return etl_state.last_date(state)
+
+
+def fetch_start(watermark: date | None, overlap: int = overlap_days) -> date | None:
+    """
+    first date a fetcher has to request, None means the full default window
+    """
+    if watermark is None:
+        return None
+
+    return watermark - timedelta(days=overlap)
+
+
+def days_since(start: date | None, default: int, minimum: int = 2) -> int:
+    """
+    size of a `days` / `limit` style window reaching back to start (inclusive of today),
+    default when there is no start
+    """
+    if start is None:
+        return default
+
+    today = datetime.now(timezone.utc).date()
+
+    return min(default, max(minimum, (today - start).days + 1))
+
+
+def write(credentials, dataset: str, destination_table: str, dataframe: pd.DataFrame,
+          table_schema: list[dict], date_column: str, partition_field: str | None = None,
+          description: str | None = None) -> None:
+    """
+    upsert the fetched rows on date_column and move the watermark to their last date
+    """
+    if dataframe.empty:
+        logger.info(f"{destination_table}: nothing new to load")
+        return
+
+    bq_client.merge_rows(
+        dataframe=dataframe,
+        destination_table=dataset + destination_table,
+        table_schema=table_schema,
+        credentials=credentials,
+        key_columns=[date_column],
+        partition_field=partition_field,
+        description=description
+    )
+
+    save(credentials, dataset, destination_table, dataframe, date_column)
+
+
+def save(credentials, dataset: str, destination_table: str, dataframe: pd.DataFrame, date_column: str) -> None:
+    """
+    record the newest date of dataframe as the watermark of destination_table
+    """
+    if not etl_state.incremental_enabled() or dataframe.empty:
+        return
+
+    last = pd.to_datetime(dataframe[date_column]).max().date()
+    etl_state.save(credentials, dataset, state_name(destination_table), {'last_date': last.isoformat()})
@@ -0,0 +1,35 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from technical_indicators import metrics_store
+
+log = (
+    "2025-10-08 14:42:37,821 - __main__ - INFO - Starting ETL job: Technical_Indicators.Bitcoin_Transactions_Volume\n"
+    "2025-10-08 14:42:40,344 - technical_indicators.bitcoin_transactions_volume - INFO - "
+    "Query processed 353,640 bytes (0.34 MB)\n"
+    "2025-10-08 14:42:44,075 - pandas_gbq.gbq_connector - INFO - \r100 out of 100 rows loaded.\n"
+    "2025-10-08 14:42:44,080 - __main__ - INFO - Completed Technical_Indicators.Bitcoin_Transactions_Volume "
+    "in 6.26 seconds\n"
+    "2025-10-08 14:42:44,090 - __main__ - INFO - Total execution time: 6.27 seconds\n"
+)
+
+
+class ParseLogfileTest(unittest.TestCase):
+
+    def test_rows_loaded_after_carriage_return(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "logfile.txt"
+            path.write_bytes(log.encode())
+
+            rows = metrics_store.parse_logfile(path)
+
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['job'], 'bitcoin_transactions_volume')
+        self.assertEqual(rows[0]['rows_loaded'], 100)
+        self.assertEqual(rows[0]['bytes_processed'], 353_640)
+        self.assertEqual(rows[0]['seconds'], 6.26)
+
+
+if __name__ == "__main__":
+    unittest.main()
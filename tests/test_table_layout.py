@@ -0,0 +1,52 @@
+import unittest
+from unittest import mock
+
+from google.cloud import bigquery
+
+from technical_indicators import table_layout
+
+
+class MigrationTest(unittest.TestCase):
+
+    def test_statement_creates_a_new_table(self):
+        layout = {'partitioning': 'MONTH', 'field': 'date_', 'clustering': ['date_']}
+        ddl = table_layout.migration_ddl('p.signals.btc_ma', 'p.signals.btc_ma_migrating', {'date_': 'DATE'}, layout)
+
+        self.assertTrue(ddl.startswith("CREATE TABLE `p.signals.btc_ma_migrating`"))
+        self.assertNotIn("OR REPLACE", ddl)
+        self.assertIn("PARTITION BY DATE_TRUNC(`date_`, MONTH)", ddl)
+        self.assertIn("CLUSTER BY `date_`", ddl)
+        self.assertTrue(ddl.endswith("AS SELECT * FROM `p.signals.btc_ma`"))
+
+    def test_unpartitioned_table_gets_partitioned(self):
+        layout = {'partitioning': 'DAY', 'field': 'timestamp', 'clustering': ['timestamp']}
+        ddl = table_layout.migration_ddl('p.s.t', 'p.s.t_migrating', {'timestamp': 'TIMESTAMP'}, layout)
+
+        self.assertIn("PARTITION BY TIMESTAMP_TRUNC(`timestamp`, DAY)", ddl)
+
+    def test_migrate_swaps_the_new_table_in(self):
+        schema = [bigquery.SchemaField('date_', 'DATE', description='day')]
+        # full_table_id is only set on tables read from the API
+        table = bigquery.Table.from_api_repr({
+            'id': 'p:signals.btc_ma',
+            'tableReference': {'projectId': 'p', 'datasetId': 'signals', 'tableId': 'btc_ma'},
+            'description': 'moving averages'
+        })
+        table.schema = schema
+        client = mock.Mock()
+
+        table_layout.migrate(client, table, {'partitioning': 'MONTH', 'field': 'date_', 'clustering': ['date_']})
+
+        ddl = client.query.call_args.args[0]
+        self.assertTrue(ddl.startswith("CREATE TABLE `p.signals.btc_ma_migrating`"))
+        client.delete_table.assert_any_call('p.signals.btc_ma')
+        client.copy_table.assert_called_once_with('p.signals.btc_ma_migrating', 'p.signals.btc_ma')
+        client.get_table.assert_called_once_with('p.signals.btc_ma')
+
+        restored = client.update_table.call_args.args[0]
+        self.assertEqual(restored.description, 'moving averages')
+        self.assertEqual(restored.schema, schema)
+
+
+if __name__ == "__main__":
+    unittest.main()